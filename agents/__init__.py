@@ -1,13 +1,26 @@
-from flask import Blueprint, request, jsonify
+import time
+
+from flask import Blueprint, Response, request, jsonify
 from .multi_agent import MultiAgent
-from .utils.output_modifiers import CustomJSONEncoder
-from firestore.utils import get_agent_config, create_run
+from .agent_cache import agent_cache
+from .streaming import stream_agent_run
+from .sessions import is_valid_session_name, session_key
+from .utils.output_modifiers import project_result, output_text, json_response
+from firestore.utils import get_agent_config, queue_run
 from middleware.auth import jwt_required
 from .utils.agent_utils import create_new_agent
-import json
 
 agents_bp = Blueprint('agents', __name__)
 
+def wants_stream():
+    return bool(request.json.get("stream")) or request.args.get('stream', '').lower() == 'true'
+
+def sse_response(events):
+    return Response(events, mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
 @agents_bp.route('/run_agent', methods=['POST'])
 @jwt_required
 def run_agent_with_config():
@@ -24,7 +37,7 @@ def run_agent_with_config():
             }), 400
 
         # Create and save the agent first
-        agent_response, status_code = create_new_agent(user_id, agent_config)
+        agent_response, status_code = create_new_agent(user_id, agent_config, defer_write=True)
         if status_code != 201:
             return agent_response, status_code  # Return the response directly
 
@@ -34,33 +47,33 @@ def run_agent_with_config():
         
         agent_config['agent_id'] = agent_id
 
+        if wants_stream():
+            return sse_response(stream_agent_run(agent_config, user_id, user_input, cached=False))
+
         # Run the agent with the config
         multi_agent = MultiAgent(agent_config)
-        result = multi_agent.run(user_input)
-        result = json.loads(json.dumps(result, cls=CustomJSONEncoder))
-
-        # Extract output content consistently
-        output_content = (
-            result.get("output", {}).get("content")
-            if isinstance(result.get("output"), dict)
-            else str(result)
-        )
+        started = time.perf_counter()
+        result = project_result(multi_agent.run(user_input))
+        metrics = multi_agent.run_metrics(time.perf_counter() - started)
+        output_content = output_text(result)
 
         # Store the run information
         run_data = {
             "user_id": user_id,
             "user_input": user_input,
             "output": output_content,
+            "metrics": metrics,
         }
-        run_id = create_run(agent_id, run_data)
+        run_id = queue_run(agent_id, run_data)
 
         response_data = {
             "agent_id": agent_id,
             "run_id": run_id,
-            "result": result
+            "result": result,
+            "metrics": metrics
         }
 
-        return jsonify(response_data), 200
+        return json_response(response_data)
     except ValueError as e:
         return jsonify({"error": "Invalid input format", "details": str(e)}), 422
     except TypeError as e:
@@ -86,35 +99,65 @@ def run_agent_by_id():
         if status_code != 200:
             return jsonify(agent_response), status_code
 
+        # Optional conversation to continue; without it every run starts fresh
+        session_name = request.json.get("session_id")
+        if session_name is not None and not is_valid_session_name(session_name):
+            return jsonify({"error": "session_id must be 1-64 letters, digits, '-' or '_'"}), 400
+        session_id = session_key(user_id, agent_id, session_name) if session_name else None
+
         agent_data = agent_response.get_json()
         agent_data['agent_id'] = agent_id
-        # Run the agent with the config
-        multi_agent = MultiAgent(agent_data)
-        result = multi_agent.run(user_input)
-        result=json.loads(json.dumps(result, cls=CustomJSONEncoder))
 
-        output_content = (
-            result.get("output", {}).get("content")
-            if isinstance(result.get("output"), dict)
-            else str(result)
-        )
+        if wants_stream():
+            return sse_response(stream_agent_run(agent_data, user_id, user_input, session_id=session_id))
+
+        # Run the agent with the config, reusing a team already built for this version of it
+        with agent_cache.lease(agent_data) as multi_agent:
+            if session_id:
+                multi_agent.use_session(user_id, session_id)
+            started = time.perf_counter()
+            result = project_result(multi_agent.run(user_input))
+            metrics = multi_agent.run_metrics(time.perf_counter() - started)
+        output_content = output_text(result)
 
         # Store the run information
         run_data = {
             "user_id": user_id,
             "user_input": user_input,
-            "output": output_content
+            "output": output_content,
+            "metrics": metrics,
         }
-        run_id = create_run(agent_id, run_data)
+        run_id = queue_run(agent_id, run_data)
 
         response_data = {
             "run_id": run_id,
-            "result": result
+            "result": result,
+            "metrics": metrics
         }
+        if session_name:
+            response_data["session_id"] = session_name
 
-        return jsonify(response_data), 200
+        return json_response(response_data)
     except TypeError as e:
         return jsonify({"error": f"Serialization error: {str(e)}"}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+
+@agents_bp.route('/tools', methods=['GET'])
+def available_tools():
+    from .tools import list_tools
+    return jsonify(list_tools()), 200
+
+@agents_bp.route('/sessions/<agent_id>/<session_name>', methods=['DELETE'])
+@jwt_required
+def delete_agent_session(agent_id, session_name):
+    """Forgets a stored conversation so the next run with this session_id starts fresh."""
+    from .sessions import get_session_storage
+    if not is_valid_session_name(session_name):
+        return jsonify({"error": "Invalid session_id"}), 400
+    try:
+        get_session_storage().delete_session(session_key(request.user_id, agent_id, session_name))
+        return jsonify({"message": "Session deleted successfully"}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
@@ -0,0 +1,90 @@
+import collections
+import contextlib
+import os
+import threading
+
+from .multi_agent import MultiAgent
+
+# Saved agents kept warm per process, least recently used evicted first
+AGENT_CACHE_SIZE = int(os.getenv("AGENT_CACHE_SIZE", 64))
+# Idle instances kept per agent version; concurrent runs beyond this build their own
+AGENT_CACHE_IDLE_PER_AGENT = int(os.getenv("AGENT_CACHE_IDLE_PER_AGENT", 4))
+
+
+class AgentCache:
+    """
+    Keeps constructed MultiAgent teams for saved agents so a run does not rebuild
+    every member agent, model client and tool. Entries are keyed by agent_id and
+    config version (updated_at, or created_at for never-updated agents), so a
+    changed config never matches an old entry.
+
+    An instance is leased to one run at a time and its session state is reset
+    before it goes back to the pool, so runs never see each other's messages.
+    """
+
+    def __init__(self, max_agents: int = AGENT_CACHE_SIZE, idle_per_agent: int = AGENT_CACHE_IDLE_PER_AGENT):
+        self.max_agents = max_agents
+        self.idle_per_agent = idle_per_agent
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        # Bumped on invalidation so in-flight leases are not returned to the pool
+        self.generations = {}
+
+    @staticmethod
+    def key(agent_config):
+        version = agent_config.get("updated_at") or agent_config.get("created_at")
+        return agent_config.get("agent_id"), version
+
+    def _checkout(self, key):
+        with self.lock:
+            generation = self.generations.get(key[0], 0)
+            idle = self.entries.get(key)
+            if not idle:
+                return None, generation
+            self.entries.move_to_end(key)
+            return idle.pop(), generation
+
+    def _checkin(self, key, multi_agent, generation):
+        try:
+            multi_agent.reset()
+        except Exception as e:
+            print(f"Error resetting agent {key[0]}, dropping it from the cache: {e}")
+            return
+        with self.lock:
+            if self.generations.get(key[0], 0) != generation:
+                # The agent was updated or deleted while this run was in flight
+                return
+            idle = self.entries.setdefault(key, [])
+            if len(idle) < self.idle_per_agent:
+                idle.append(multi_agent)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_agents:
+                self.entries.popitem(last=False)
+
+    @contextlib.contextmanager
+    def lease(self, agent_config):
+        """
+        Yields a MultiAgent for the config, reusing an idle one when available.
+        """
+        key = self.key(agent_config)
+        if key[0] is None or key[1] is None:
+            # Unversioned configs cannot be told apart from their edits; never cache them
+            yield MultiAgent(agent_config)
+            return
+
+        multi_agent, generation = self._checkout(key)
+        if multi_agent is None:
+            multi_agent = MultiAgent(agent_config)
+        try:
+            yield multi_agent
+        finally:
+            self._checkin(key, multi_agent, generation)
+
+    def invalidate(self, agent_id: str):
+        with self.lock:
+            self.generations[agent_id] = self.generations.get(agent_id, 0) + 1
+            for key in [key for key in self.entries if key[0] == agent_id]:
+                del self.entries[key]
+
+
+agent_cache = AgentCache()
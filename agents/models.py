@@ -0,0 +1,93 @@
+import importlib
+import os
+import threading
+
+import httpx
+
+DEFAULT_MODEL = "gpt-4o"
+
+# Model classes per provider, imported on first use so SDKs of unused providers
+# need not be installed.
+PROVIDERS = {
+    "openai": ("phi.model.openai", "OpenAIChat"),
+    "deepseek": ("phi.model.deepseek", "DeepSeekChat"),
+}
+# Providers that speak the OpenAI API and so can share one pooled HTTP client
+OPENAI_COMPATIBLE = {"openai", "deepseek"}
+
+# 🔹 Models an agent config can name, with per-model request defaults and
+# price in USD per million (input, output) tokens
+MODEL_REGISTRY = {
+    "gpt-4o": {"provider": "openai", "timeout": 120, "params": {"max_tokens": 4096}, "price": (2.50, 10.00)},
+    "gpt-4o-mini": {"provider": "openai", "timeout": 60, "params": {"max_tokens": 2048}, "price": (0.15, 0.60)},
+    "gpt-4.1": {"provider": "openai", "timeout": 120, "params": {"max_tokens": 4096}, "price": (2.00, 8.00)},
+    "gpt-4.1-mini": {"provider": "openai", "timeout": 60, "params": {"max_tokens": 2048}, "price": (0.40, 1.60)},
+    "gpt-4.1-nano": {"provider": "openai", "timeout": 30, "params": {"max_tokens": 1024}, "price": (0.10, 0.40)},
+    "o3-mini": {"provider": "openai", "timeout": 180, "params": {"max_completion_tokens": 8192}, "price": (1.10, 4.40)},
+    "deepseek-chat": {"provider": "deepseek", "timeout": 120, "params": {"max_tokens": 4096}, "price": (0.27, 1.10)},
+}
+
+_clients = {}
+_clients_lock = threading.Lock()
+_http_client = None
+
+
+def _get_http_client():
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.Client(limits=httpx.Limits(
+            max_connections=int(os.getenv("MODEL_HTTP_MAX_CONNECTIONS", 100)),
+            max_keepalive_connections=int(os.getenv("MODEL_HTTP_MAX_KEEPALIVE", 20)),
+        ))
+    return _http_client
+
+
+def _model_class(provider):
+    module, attr = PROVIDERS[provider]
+    return getattr(importlib.import_module(module), attr)
+
+
+def _get_client(provider, timeout):
+    """
+    One API client per provider and timeout, shared by every agent in the process.
+    The clients are thread safe and keep their connections alive between runs.
+    """
+    key = (provider, timeout)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            prototype = _model_class(provider)(timeout=timeout)
+            if provider in OPENAI_COMPATIBLE:
+                prototype.http_client = _get_http_client()
+            client = _clients[key] = prototype.get_client()
+        return client
+
+
+def is_known_model(model_name) -> bool:
+    return model_name in MODEL_REGISTRY
+
+
+def get_model(model_name: str = None):
+    """
+    Builds the phi model for a config's model name, on the shared client for its
+    provider. Unknown names (configs saved before validation) get the default model.
+    """
+    if model_name not in MODEL_REGISTRY:
+        if model_name:
+            print(f"Unknown model {model_name}, using {DEFAULT_MODEL}")
+        model_name = DEFAULT_MODEL
+    spec = MODEL_REGISTRY[model_name]
+    return _model_class(spec["provider"])(
+        id=model_name,
+        client=_get_client(spec["provider"], spec["timeout"]),
+        **spec["params"],
+    )
+
+
+def estimate_cost(model_name, input_tokens, output_tokens):
+    """USD cost of a model's token usage, or None for models without a known price."""
+    spec = MODEL_REGISTRY.get(model_name)
+    if spec is None or "price" not in spec:
+        return None
+    input_price, output_price = spec["price"]
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
@@ -1,33 +1,118 @@
+import concurrent.futures
+import contextvars
 import json
-from typing import Dict, Any, List
-from phi.agent import Agent
-from phi.model.openai import OpenAIChat
+import os
+from typing import Dict, Any, List, Callable
+from phi.agent import Agent, RunResponse
+from phi.memory.agent import AgentMemory
+from phi.run.response import RunEvent
+from pydantic import BaseModel, Field
 from .tools import get_tool
+from .models import get_model, estimate_cost
 from dotenv import load_dotenv
 
 load_dotenv()
 
+EXECUTION_STRATEGIES = ("sequential", "parallel", "map-reduce")
+# Members run at once in the parallel and map-reduce strategies, unless the config sets max_parallel
+DEFAULT_MAX_PARALLEL = int(os.getenv("AGENT_MAX_PARALLEL", 4))
+
+# Set while a team runs in streaming mode; members report their chunks to it
+_stream_listener = contextvars.ContextVar("agent_stream_listener", default=None)
+
+
+class MemberAgent(Agent):
+    """
+    Team member that reports its streamed chunks (tokens and tool calls) to the
+    active stream listener. phi's transfer function only hands the leader the
+    member's final text, so without this members would be silent until done.
+    """
+
+    def run(self, message=None, *, stream: bool = False, **kwargs):
+        listener = _stream_listener.get()
+        if not stream or listener is None:
+            return super().run(message, stream=stream, **kwargs)
+        kwargs["stream_intermediate_steps"] = True
+        return self._forward_stream(super().run(message, stream=True, **kwargs), listener)
+
+    def _forward_stream(self, chunks, listener):
+        for chunk in chunks:
+            listener(self.name, chunk)
+            # The leader only expects content chunks back from a member
+            if chunk.event == RunEvent.run_response.value:
+                yield chunk
+
+
+def stream_event(agent_name: str, chunk: RunResponse):
+    """Maps a streamed phi chunk to an (event, data) pair for the client, or None to skip it."""
+    if chunk.event == RunEvent.run_response.value:
+        if not chunk.content:
+            return None
+        return "token", {"agent": agent_name, "content": chunk.content}
+    if chunk.event in (RunEvent.tool_call_started.value, RunEvent.tool_call_completed.value):
+        tool = chunk.tools[-1] if chunk.tools else {}
+        event = "tool_call_started" if chunk.event == RunEvent.tool_call_started.value else "tool_call_completed"
+        return event, {"agent": agent_name, "tool_name": tool.get("tool_name"), "tool_args": tool.get("tool_args")}
+    return None
+
+
+class Assignment(BaseModel):
+    agent: str = Field(..., description="Name of the team member")
+    task: str = Field(..., description="Self-contained subtask for that member")
+
+
+class TaskPlan(BaseModel):
+    assignments: List[Assignment]
+
+
 class MultiAgent:
     def __init__(self, agent_config: Dict[str, Any]):
         self.agent_id = agent_config.get("agent_id")
         self.name = agent_config.get("name")
+        self.execution = agent_config.get("execution", "sequential")
+        self.max_parallel = agent_config.get("max_parallel") or DEFAULT_MAX_PARALLEL
+        # Model for the leader, synthesizer and planner; members set their own
+        self.model_name = agent_config.get("model")
         self.agents = self.initialize_agents(agent_config.get("agents", []))
         self.team_agent = Agent(
+            model=get_model(self.model_name),
             team=[agent for agent in self.agents],
             instructions=["Ensure logical flow between responses"],
             show_tool_calls=True,
             markdown=True,
         )
+        self.synthesizer = None
+        self.planner = None
+        if self.execution != "sequential":
+            self.synthesizer = Agent(
+                model=get_model(self.model_name),
+                description="You combine the work of several specialists into one answer.",
+                instructions=[
+                    "Answer the original request using the results from your team.",
+                    "Ensure logical flow between the parts and do not repeat content.",
+                ],
+                markdown=True,
+            )
+        if self.execution == "map-reduce":
+            self.planner = Agent(
+                model=get_model(self.model_name),
+                description="You split a request into independent subtasks for the members of a team.",
+                instructions=[
+                    "Give each member that can contribute one self-contained subtask.",
+                    "Only use the member names listed.",
+                ],
+                response_model=TaskPlan,
+            )
 
     def initialize_agents(self, agent_list: List[Dict[str, Any]]):
         """Initializes agents dynamically from JSON."""
         agents = []
         for agent_data in agent_list:
             tools = [get_tool(tool) for tool in agent_data.get("tools", [])]
-            agent = Agent(
+            agent = MemberAgent(
                 name=agent_data["name"],
                 role=agent_data["role"],
-                model=OpenAIChat(id="gpt-4o"),
+                model=get_model(agent_data.get("model")),
                 tools=tools,
                 instructions=agent_data.get("instructions", []),
                 description=agent_data.get("description", ""),
@@ -38,9 +123,190 @@ class MultiAgent:
         return agents
 
     def run(self, user_input: str) -> Dict[str, Any]:
-        """Runs the multi-agent team in sequence."""
-        response = self.team_agent.run(user_input)
-        return {"agent_id": self.agent_id, "input": user_input, "output": response}
+        """Runs the multi-agent team with the configured execution strategy."""
+        if self.execution == "sequential":
+            response = self.team_agent.run(user_input)
+            return {"agent_id": self.agent_id, "input": user_input, "output": response}
+        return self._run_fan_out(user_input)
+
+    def run_stream(self, user_input: str, emit: Callable[[str, Dict[str, Any]], None]) -> Dict[str, Any]:
+        """
+        Runs the team with streaming, calling emit(event, data) for every leader
+        and member token and tool call as it happens. Returns the same result as run().
+        """
+        def listener(agent_name, chunk):
+            event = stream_event(agent_name, chunk)
+            if event:
+                emit(*event)
+
+        token = _stream_listener.set(listener)
+        try:
+            if self.execution != "sequential":
+                return self._run_fan_out(user_input)
+            for chunk in self.team_agent.run(user_input, stream=True, stream_intermediate_steps=True):
+                listener(self.name or "team", chunk)
+        finally:
+            _stream_listener.reset(token)
+        return {"agent_id": self.agent_id, "input": user_input, "output": self.team_agent.run_response}
+
+    def _run_fan_out(self, user_input):
+        """
+        Runs the members concurrently (on the request as is, or on the subtasks the
+        planner assigns them for map-reduce) and merges their outputs in one final step.
+        """
+        tasks = self._plan(user_input) if self.execution == "map-reduce" else None
+        if not tasks:
+            tasks = [(agent, user_input) for agent in self.agents]
+        names = [agent.name for agent, _ in tasks]
+        # Names key the merged outputs; two members sharing one must not overwrite each other
+        keys = [name if names.count(name) == 1 else f"{name} ({i})" for i, name in enumerate(names, 1)]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.max_parallel, len(tasks))) as executor:
+            # Each member runs in a copy of this context so stream listeners reach it
+            futures = [
+                executor.submit(contextvars.copy_context().run, self._run_member, agent, task)
+                for agent, task in tasks
+            ]
+            member_outputs = [(key, future.result()) for key, future in zip(keys, futures)]
+
+        response = self._synthesize(user_input, member_outputs)
+        return {
+            "agent_id": self.agent_id,
+            "input": user_input,
+            "output": response,
+            "members": {name: output for name, output in member_outputs},
+        }
+
+    def _plan(self, user_input):
+        members = "\n".join(f"- {agent.name}: {agent.role}" for agent in self.agents)
+        try:
+            plan = self.planner.run(f"Team members:\n{members}\n\nRequest:\n{user_input}").content
+        except Exception as e:
+            print(f"Error planning subtasks for agent {self.agent_id}, giving every member the request: {e}")
+            return None
+        if not isinstance(plan, TaskPlan):
+            return None
+        agents_by_name = {agent.name: agent for agent in self.agents}
+        # One task per member: a phi agent is not safe to run twice at once, so a
+        # member given several subtasks gets them together in a single run
+        subtasks = {}
+        for assignment in plan.assignments:
+            if assignment.agent in agents_by_name:
+                subtasks.setdefault(assignment.agent, []).append(assignment.task)
+        return [
+            (agents_by_name[name], tasks[0] if len(tasks) == 1
+             else "Complete each of these subtasks:\n" + "\n".join(f"{i}. {task}" for i, task in enumerate(tasks, 1)))
+            for name, tasks in subtasks.items()
+        ]
+
+    @staticmethod
+    def _run_member(agent, task):
+        try:
+            if _stream_listener.get() is None:
+                content = agent.run(task).content
+            else:
+                for _ in agent.run(task, stream=True):
+                    pass
+                content = agent.run_response.content
+        except Exception as e:
+            # One failing member should not sink the others' work
+            return f"Failed: {e}"
+        if content is None:
+            return "No response from the member agent."
+        return content if isinstance(content, str) else json.dumps(content, default=str)
+
+    def _synthesize(self, user_input, member_outputs):
+        results = "\n\n".join(f"## {name}\n{output}" for name, output in member_outputs)
+        prompt = f"Original request:\n{user_input}\n\nResults from your team:\n{results}"
+        listener = _stream_listener.get()
+        if listener is None:
+            return self.synthesizer.run(prompt)
+        for chunk in self.synthesizer.run(prompt, stream=True):
+            listener(self.name or "team", chunk)
+        return self.synthesizer.run_response
+
+    def run_metrics(self, latency: float = None) -> Dict[str, Any]:
+        """
+        Token usage, model time, time to first token and tool call durations of
+        the last run, per agent, from the metrics phi keeps on each model. Read
+        it before the instance is reset.
+        """
+        roles = [("leader", self.team_agent), ("synthesizer", self.synthesizer), ("planner", self.planner)]
+        roles += [("member", agent) for agent in self.agents]
+        members = []
+        for role, agent in roles:
+            metrics = agent.model.metrics if agent is not None and agent.model is not None else None
+            if not metrics:
+                continue
+            input_tokens = metrics.get("input_tokens", 0)
+            output_tokens = metrics.get("output_tokens", 0)
+            time_to_first_token = metrics.get("time_to_first_token")
+            members.append({
+                "agent": agent.name or role,
+                "role": role,
+                "model": agent.model.id,
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "llm_calls": len(metrics.get("response_times", [])),
+                "llm_time": round(sum(metrics.get("response_times", [])), 3),
+                "time_to_first_token": round(time_to_first_token[0], 3) if time_to_first_token else None,
+                "tool_calls": {
+                    name: {"count": len(times), "time": round(sum(times), 3)}
+                    for name, times in metrics.get("tool_call_times", {}).items()
+                },
+                "cost_usd": estimate_cost(agent.model.id, input_tokens, output_tokens),
+            })
+        return {
+            "latency": round(latency, 3) if latency is not None else None,
+            "input_tokens": sum(member["input_tokens"] for member in members),
+            "output_tokens": sum(member["output_tokens"] for member in members),
+            "cost_usd": sum(member["cost_usd"] or 0 for member in members),
+            "members": members,
+        }
+
+    @property
+    def conversation_agent(self):
+        """The agent that answers the user, and so the one that keeps the conversation."""
+        return self.team_agent if self.execution == "sequential" else self.synthesizer
+
+    def use_session(self, user_id: str, session_id: str):
+        """
+        Continues a stored conversation: the answering agent loads the session's
+        rolling summary and last turns before the run and saves them after it.
+        """
+        from .sessions import SessionMemory, get_session_storage
+        agent = self.conversation_agent
+        agent.memory = SessionMemory()
+        agent.storage = get_session_storage()
+        agent.user_id = user_id
+        agent.agent_id = self.agent_id
+        agent.session_id = session_id
+        agent.add_history_to_messages = True
+        agent.num_history_responses = agent.memory.max_turns
+
+    def _all_agents(self):
+        return [agent for agent in [self.team_agent, *self.agents, self.synthesizer, self.planner] if agent is not None]
+
+    def reset(self):
+        """Starts a fresh session on the team and every member so the next run shares no state."""
+        conversation_agent = self.conversation_agent
+        if conversation_agent.storage is not None:
+            # Detach first, or starting the new session would write an empty one to storage
+            conversation_agent.storage = None
+            conversation_agent.memory = AgentMemory()
+            conversation_agent.user_id = None
+            conversation_agent.add_history_to_messages = False
+        for agent in self._all_agents():
+            agent.new_session()
+            if agent.model is not None:
+                # model.clear() drops functions but keeps the tool schemas, and the
+                # next run's update_model() would append every one of them again
+                agent.model.tools = None
+                agent.model.functions = None
+            agent.session_data = None
+            agent.run_id = None
+            agent.run_input = None
+            agent.run_response = RunResponse()
 
 # # 🔹 Example Usage
 # if __name__ == "__main__":
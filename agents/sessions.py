@@ -0,0 +1,186 @@
+import json
+import os
+import re
+import threading
+import time
+from typing import List, Optional
+
+from phi.agent import AgentSession
+from phi.memory.agent import AgentMemory
+from phi.memory.summarizer import MemorySummarizer
+from phi.model.message import Message
+from phi.storage.agent.base import AgentStorage
+
+from firestore.db import get_db
+
+from .models import get_model
+
+# Turns kept verbatim in a session; older turns are folded into the rolling summary
+SESSION_HISTORY_TURNS = int(os.getenv("AGENT_SESSION_HISTORY_TURNS", 6))
+# Upper bound on the verbatim history sent with each run, in (estimated) tokens
+SESSION_HISTORY_TOKEN_BUDGET = int(os.getenv("AGENT_SESSION_TOKEN_BUDGET", 6000))
+SESSION_SUMMARY_MODEL = os.getenv("AGENT_SESSION_SUMMARY_MODEL", "gpt-4o-mini")
+SESSIONS_COLLECTION = "agent_sessions"
+
+_SESSION_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def _estimate_tokens(messages: List[Message]) -> int:
+    # ~4 characters per token is close enough for budgeting
+    return sum(len(message.get_content_string() or "") for message in messages) // 4
+
+
+class SessionMemory(AgentMemory):
+    """
+    Agent memory bounded to the last few turns. Turns that fall out of the
+    window (by count or by token budget) are folded into a rolling summary,
+    so the summarizer only runs when something is evicted.
+    """
+
+    max_turns: int = SESSION_HISTORY_TURNS
+    token_budget: int = SESSION_HISTORY_TOKEN_BUDGET
+    create_session_summary: bool = True
+    update_session_summary_after_run: bool = True
+
+    def update_summary(self):
+        keep = 0
+        tokens = 0
+        for run in reversed(self.runs):
+            run_tokens = _estimate_tokens(run.response.messages or []) if run.response else 0
+            if keep >= self.max_turns or (keep > 0 and tokens + run_tokens > self.token_budget):
+                break
+            keep += 1
+            tokens += run_tokens
+
+        evicted = self.runs[:len(self.runs) - keep]
+        if not evicted:
+            return self.summary
+
+        if self.summarizer is None:
+            self.summarizer = MemorySummarizer(model=get_model(SESSION_SUMMARY_MODEL))
+        message_pairs = self.get_message_pairs()[:len(evicted)]
+        if self.summary is not None:
+            # Carry the earlier summary forward so nothing older is lost
+            message_pairs.insert(0, (
+                Message(role="user", content=f"Summary of the conversation so far: {self.summary.summary}"),
+                Message(role="assistant", content="Understood."),
+            ))
+        self.updating_memory = True
+        try:
+            summary = self.summarizer.run(message_pairs)
+        finally:
+            self.updating_memory = False
+        if summary is None:
+            # Keep the turns until a summary succeeds rather than losing them
+            return self.summary
+
+        self.summary = summary
+        self.runs = self.runs[len(evicted):]
+        self.messages = [
+            message
+            for run in self.runs if run.response and run.response.messages
+            for message in run.response.messages
+        ]
+        return self.summary
+
+
+class FirestoreAgentStorage(AgentStorage):
+    """
+    phi agent session storage on Firestore. The session memory is stored as a
+    JSON string, since Firestore rejects the nested arrays phi messages can hold.
+    """
+
+    def __init__(self, collection: str = SESSIONS_COLLECTION):
+        self.collection = collection
+
+    def _collection(self):
+        db = get_db()
+        return db.collection(self.collection)
+
+    @staticmethod
+    def _to_session(data):
+        if data is None:
+            return None
+        return AgentSession.model_validate(json.loads(data["session"]))
+
+    def create(self) -> None:
+        pass
+
+    def read(self, session_id: str, user_id: Optional[str] = None) -> Optional[AgentSession]:
+        snapshot = self._collection().document(session_id).get()
+        if not snapshot.exists:
+            return None
+        data = snapshot.to_dict()
+        if user_id and data.get("user_id") != user_id:
+            return None
+        return self._to_session(data)
+
+    def _query(self, user_id=None, agent_id=None):
+        query = self._collection()
+        if user_id:
+            query = query.where("user_id", "==", user_id)
+        if agent_id:
+            query = query.where("agent_id", "==", agent_id)
+        return query
+
+    def get_all_session_ids(self, user_id: Optional[str] = None, agent_id: Optional[str] = None) -> List[str]:
+        return [snapshot.id for snapshot in self._query(user_id, agent_id).select(["user_id"]).stream()]
+
+    def get_all_sessions(self, user_id: Optional[str] = None, agent_id: Optional[str] = None) -> List[AgentSession]:
+        return [self._to_session(snapshot.to_dict()) for snapshot in self._query(user_id, agent_id).stream()]
+
+    def upsert(self, session: AgentSession) -> Optional[AgentSession]:
+        now = int(time.time())
+        session.created_at = session.created_at or now
+        session.updated_at = now
+        self._collection().document(session.session_id).set({
+            "user_id": session.user_id,
+            "agent_id": session.agent_id,
+            "updated_at": now,
+            "session": json.dumps(session.model_dump(), default=str),
+        })
+        return session
+
+    def delete_session(self, session_id: Optional[str] = None):
+        if session_id:
+            self._collection().document(session_id).delete()
+
+    def drop(self) -> None:
+        pass
+
+    def upgrade_schema(self) -> None:
+        pass
+
+
+def get_session_storage():
+    """
+    Firestore in production; AGENT_SESSION_STORAGE=sqlite keeps sessions in a
+    local SQLite file (phi's SqlAgentStorage, which needs SQLAlchemy) for development.
+    """
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            if os.getenv("AGENT_SESSION_STORAGE", "firestore") == "sqlite":
+                from phi.storage.agent.sqlite import SqlAgentStorage
+                _storage = SqlAgentStorage(
+                    table_name=SESSIONS_COLLECTION,
+                    db_file=os.getenv("AGENT_SESSION_DB", "tmp/agent_sessions.db"),
+                )
+            else:
+                _storage = FirestoreAgentStorage()
+        return _storage
+
+
+def is_valid_session_name(session_name) -> bool:
+    return isinstance(session_name, str) and bool(_SESSION_NAME.match(session_name))
+
+
+def session_key(user_id: str, agent_id: str, session_name: str = "default") -> str:
+    """
+    The stored session id. It is built server side from the user and agent, so a
+    client can only ever name sessions inside its own namespace.
+    """
+    return f"{user_id}_{agent_id}_{session_name}"
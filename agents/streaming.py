@@ -0,0 +1,97 @@
+import concurrent.futures
+import os
+import queue
+import threading
+import time
+
+from .agent_cache import agent_cache
+from .multi_agent import MultiAgent
+from .utils.output_modifiers import dumps
+
+# Seconds without an event before a keep-alive comment is sent
+HEARTBEAT_INTERVAL = 15
+
+_END = object()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """
+    Creates the worker pool on first use, so it is never inherited across a fork.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=int(os.getenv("AGENT_STREAM_WORKERS", 16)),
+                thread_name_prefix="agent-stream",
+            )
+        return _executor
+
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {dumps(data).decode()}\n\n"
+
+
+def _run(agent_config, user_id, user_input, cached, session_id, events):
+    from firestore.utils import queue_run
+
+    started = time.perf_counter()
+    first_token_at = []
+
+    def emit(event, data):
+        if event == "token" and not first_token_at:
+            first_token_at.append(time.perf_counter())
+        events.put((event, data))
+
+    def run(multi_agent):
+        result = multi_agent.run_stream(user_input, emit)
+        metrics = multi_agent.run_metrics(time.perf_counter() - started)
+        metrics["time_to_first_token"] = round(first_token_at[0] - started, 3) if first_token_at else None
+        return result["output"].content, metrics
+
+    try:
+        if cached:
+            with agent_cache.lease(agent_config) as multi_agent:
+                if session_id:
+                    multi_agent.use_session(user_id, session_id)
+                output, metrics = run(multi_agent)
+        else:
+            output, metrics = run(MultiAgent(agent_config))
+        output_content = output if isinstance(output, str) else dumps(output).decode()
+
+        # The run is stored even if the client went away mid-stream
+        run_id = queue_run(agent_config["agent_id"], {
+            "user_id": user_id,
+            "user_input": user_input,
+            "output": output_content,
+            "metrics": metrics,
+        })
+        emit("done", {"agent_id": agent_config["agent_id"], "run_id": run_id, "output": output_content})
+    except Exception as e:
+        print(f"Error streaming run for agent {agent_config.get('agent_id')}: {e}")
+        emit("error", {"error": str(e)})
+    finally:
+        events.put(_END)
+
+
+def stream_agent_run(agent_config, user_id, user_input, cached=True, session_id=None):
+    """
+    Runs the agent on a worker thread and yields its events as server-sent
+    events: token, tool_call_started, tool_call_completed, then done (with the
+    stored run_id) or error. The worker owns the run, so a client disconnect
+    does not cut the run short or lose it.
+    """
+    events = queue.Queue()
+    _get_executor().submit(_run, agent_config, user_id, user_input, cached, session_id, events)
+
+    while True:
+        try:
+            item = events.get(timeout=HEARTBEAT_INTERVAL)
+        except queue.Empty:
+            yield ": keep-alive\n\n"
+            continue
+        if item is _END:
+            return
+        yield format_sse(*item)
@@ -0,0 +1,109 @@
+import collections
+import functools
+import hashlib
+import inspect
+import json
+import os
+import threading
+import time
+
+# Entries kept in the in-process layer, least recently used evicted first
+LOCAL_CACHE_SIZE = int(os.getenv("TOOL_CACHE_LOCAL_SIZE", 2048))
+REDIS_PREFIX = "agent_tool_cache"
+
+
+class ToolResultCache:
+    """
+    Two-level cache for agent tool results: an in-process LRU in front of Redis,
+    so repeats within a process are free and repeats across processes and users
+    cost one Redis round trip instead of a call to the data provider.
+    """
+
+    def __init__(self, max_entries: int = LOCAL_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.redis = None
+        self.redis_lock = threading.Lock()
+
+    def _get_redis(self):
+        with self.redis_lock:
+            if self.redis is None:
+                from enterprise.financial_agent.tools.redis.redis_cache import RedisCache
+                self.redis = RedisCache()
+            return self.redis
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self.entries.move_to_end(key)
+                    return value
+                del self.entries[key]
+
+        try:
+            redis_client = self._get_redis().redis_client
+            value = redis_client.get(key)
+            if value is None:
+                return None
+            ttl = redis_client.ttl(key)
+        except Exception as e:
+            print(f"Error reading tool cache {key}: {e}")
+            return None
+        if ttl and ttl > 0:
+            self._set_local(key, value, now + ttl)
+        return value
+
+    def set(self, key, value, ttl):
+        self._set_local(key, value, time.time() + ttl)
+        try:
+            self._get_redis().redis_client.set(key, value, ex=ttl)
+        except Exception as e:
+            print(f"Error writing tool cache {key}: {e}")
+
+    def _set_local(self, key, value, expires_at):
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+tool_cache = ToolResultCache()
+
+
+def cache_key(tool_name, function_name, arguments):
+    canonical = json.dumps(arguments, sort_keys=True, default=str)
+    digest = hashlib.sha256(canonical.encode()).hexdigest()
+    return f"{REDIS_PREFIX}:{tool_name}:{function_name}:{digest}"
+
+
+def cached_tool_function(tool_name, function, ttl, cache=tool_cache):
+    """
+    Wraps a toolkit function so results are cached for ttl seconds, keyed on the
+    tool, the function and its arguments with defaults filled in. Only string
+    results are cached, and not the "Error ..." strings phi tools return on failure.
+    """
+    signature = inspect.signature(function)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        try:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+        except TypeError:
+            return function(*args, **kwargs)
+        key = cache_key(tool_name, function.__name__, bound.arguments)
+
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+        result = function(*args, **kwargs)
+        if isinstance(result, str) and not result.startswith("Error"):
+            cache.set(key, result, ttl)
+        return result
+
+    return wrapper
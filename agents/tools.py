@@ -1,17 +1,94 @@
-from phi.tools.duckduckgo import DuckDuckGo
-from phi.tools.yfinance import YFinanceTools
+import copy
+import importlib
+import threading
+from collections import OrderedDict
+
+from .tool_cache import cached_tool_function
+
+# 🔹 Tools agents can use, by the name configs refer to them with. Modules are
+# imported on first use so the app does not load yfinance/pandas at startup.
+TOOL_REGISTRY = OrderedDict()
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def register_tool(name, module, attr, description="", kwargs=None, cache_ttl=None):
+    """
+    Registers a phi Toolkit under the name agent configs use for it.
+
+    Parameters:
+        name (str): Name used in the agent config's "tools" list.
+        module (str): Module the toolkit class lives in, imported lazily.
+        attr (str): Toolkit class name in that module.
+        description (str): Short description for listing the available tools.
+        kwargs (dict): Constructor arguments for the toolkit.
+        cache_ttl (dict): Seconds to cache results, per toolkit function name.
+            Functions left out are not cached.
+    """
+    TOOL_REGISTRY[name] = {
+        "module": module,
+        "attr": attr,
+        "description": description,
+        "kwargs": kwargs or {},
+        "cache_ttl": cache_ttl or {},
+    }
+
+
+register_tool(
+    "DuckDuckGo", "phi.tools.duckduckgo", "DuckDuckGo",
+    description="Web and news search",
+    cache_ttl={"duckduckgo_search": 60 * 60, "duckduckgo_news": 15 * 60},
+)
+register_tool(
+    "YFinanceTools", "phi.tools.yfinance", "YFinanceTools",
+    description="Stock price, analyst recommendations and company info",
+    kwargs={"stock_price": True, "analyst_recommendations": True, "company_info": True},
+    cache_ttl={
+        "get_current_stock_price": 60,
+        "get_analyst_recommendations": 6 * 60 * 60,
+        "get_company_info": 24 * 60 * 60,
+    },
+)
+
+
+def _get_shared_instance(tool_name):
+    """
+    Builds the toolkit once per process. Its functions only read configuration
+    from the instance, so one instance can back every agent.
+    """
+    with _instances_lock:
+        instance = _instances.get(tool_name)
+        if instance is None:
+            spec = TOOL_REGISTRY[tool_name]
+            toolkit_class = getattr(importlib.import_module(spec["module"]), spec["attr"])
+            instance = toolkit_class(**spec["kwargs"])
+            for function_name, ttl in spec["cache_ttl"].items():
+                function = instance.functions.get(function_name)
+                if function is not None:
+                    function.entrypoint = cached_tool_function(tool_name, function.entrypoint, ttl)
+            _instances[tool_name] = instance
+        return instance
 
-# 🔹 Map tool names from JSON to actual PhiData tools
-TOOL_MAPPING = {
-    "DuckDuckGo": DuckDuckGo,
-    "YFinanceTools": lambda: YFinanceTools(stock_price=True, analyst_recommendations=True, company_info=True),
-}
 
 def get_tool(tool_name):
-    """Fetch the tool class from the mapping and return an instance."""
-    if tool_name in TOOL_MAPPING:
-        return TOOL_MAPPING[tool_name]()
-    raise ValueError(f"Tool {tool_name} is not available.")
+    """
+    Returns the toolkit for an agent. The shared instance is reused, but each
+    agent gets its own copies of the Function wrappers, since phi binds them
+    to the agent and wraps their entrypoint when the agent's model loads them.
+    """
+    if tool_name not in TOOL_REGISTRY:
+        raise ValueError(f"Tool {tool_name} is not available.")
+    shared = _get_shared_instance(tool_name)
+    toolkit = copy.copy(shared)
+    toolkit.functions = OrderedDict(
+        (name, function.model_copy()) for name, function in shared.functions.items()
+    )
+    return toolkit
+
+
+def list_tools():
+    return [{"name": name, "description": spec["description"]} for name, spec in TOOL_REGISTRY.items()]
 
 # from phi.tools.duckduckgo import DuckDuckGo
 # from phi.tools.yfinance import YFinanceTools
@@ -1,4 +1,6 @@
 from firestore.utils import create_agent
+from agents.multi_agent import EXECUTION_STRATEGIES
+from agents.models import MODEL_REGISTRY, is_known_model
 
 def validate_agent_config(agent_config):
     """Validate the agent configuration structure"""
@@ -22,6 +24,16 @@ def validate_agent_config(agent_config):
     if len(agent_config['agents']) < 1:
         return False, "At least one agent is required"
 
+    if 'model' in agent_config and not is_known_model(agent_config['model']):
+        return False, f"Unknown model '{agent_config['model']}'. Available: {', '.join(MODEL_REGISTRY)}"
+
+    if agent_config.get('execution', 'sequential') not in EXECUTION_STRATEGIES:
+        return False, f"Execution must be one of: {', '.join(EXECUTION_STRATEGIES)}"
+
+    max_parallel = agent_config.get('max_parallel')
+    if max_parallel is not None and (not isinstance(max_parallel, int) or isinstance(max_parallel, bool) or max_parallel < 1):
+        return False, "max_parallel must be a positive integer"
+
     # Validate each agent in the array
     required_agent_fields = {
         'name': str,
@@ -43,6 +55,9 @@ def validate_agent_config(agent_config):
             if not isinstance(agent[field], expected_type):
                 return False, f"Agent '{agent.get('name', f'at index {idx}')}' field '{field}' must be of type {expected_type.__name__}"
 
+        if not is_known_model(agent['model']):
+            return False, f"Agent '{agent['name']}' has unknown model '{agent['model']}'. Available: {', '.join(MODEL_REGISTRY)}"
+
         # Validate name length
         if len(agent['name'].strip()) < 2:
             return False, f"Agent name '{agent['name']}' must be at least 2 characters"
@@ -53,9 +68,10 @@ def validate_agent_config(agent_config):
 
     return True, None
 
-def create_new_agent(user_id, agent_config):
+def create_new_agent(user_id, agent_config, defer_write=False):
     """
-    Create a new agent with the given configuration
+    Create a new agent with the given configuration. With defer_write the agent
+    id is returned right away and the document is written in the background.
     """
     try:
         # Basic input validation
@@ -71,7 +87,7 @@ def create_new_agent(user_id, agent_config):
             return {"error": error_message}, 400
 
         # If all validations pass, create the agent
-        response, status_code = create_agent(user_id, agent_config)
+        response, status_code = create_agent(user_id, agent_config, defer_write=defer_write)
         return response, status_code
 
     except Exception as e:
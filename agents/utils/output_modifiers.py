@@ -1,6 +1,11 @@
 from dataclasses import asdict, is_dataclass
 import datetime, json
 
+import orjson
+from flask import Response
+from phi.agent import RunResponse
+from pydantic import BaseModel
+
 def obj_to_dict(obj):
     if is_dataclass(obj):
         return asdict(obj)
@@ -20,4 +25,62 @@ class CustomJSONEncoder(json.JSONEncoder):
             return obj.isoformat()
         if isinstance(obj, set):
             return list(obj)
-        return super().default(obj)
\ No newline at end of file
+        return super().default(obj)
+
+# Fields of a tool call worth returning; the rest are phi internals
+TOOL_CALL_FIELDS = ("tool_name", "tool_args", "content", "tool_call_error", "metrics")
+
+
+def project_run_response(response):
+    """
+    Keeps only what clients read from a phi RunResponse: the content, the tool
+    calls and the metrics. Message histories and other internals are dropped,
+    which is most of the size of a team run.
+    """
+    if not isinstance(response, RunResponse):
+        return response
+    return {
+        "content": response.content,
+        "content_type": response.content_type,
+        "run_id": response.run_id,
+        "model": response.model,
+        "tools": [
+            {field: tool.get(field) for field in TOOL_CALL_FIELDS if field in tool}
+            for tool in response.tools or []
+        ],
+        "metrics": response.metrics,
+        "created_at": response.created_at,
+    }
+
+
+def project_result(result):
+    """Projects the RunResponse in a MultiAgent.run() result."""
+    return {**result, "output": project_run_response(result.get("output"))}
+
+
+def output_text(projected_result):
+    """The output stored with a run: the content as text."""
+    output = projected_result.get("output")
+    if not isinstance(output, dict):
+        return str(projected_result)
+    content = output.get("content")
+    return content if isinstance(content, str) else dumps(content).decode()
+
+
+def _default(obj):
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    if is_dataclass(obj):
+        return asdict(obj)
+    if isinstance(obj, set):
+        return list(obj)
+    return str(obj)
+
+
+def dumps(obj):
+    """Encodes to JSON bytes in one pass with orjson."""
+    return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def json_response(obj, status=200):
+    return Response(dumps(obj), status=status, mimetype="application/json")
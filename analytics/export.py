@@ -0,0 +1,370 @@
+import asyncio
+import datetime
+import os
+import shutil
+import uuid
+
+from analytics.utils.constants import FIRESTORE_COLLECTIONS
+from analytics.utils.filehand import csv_writer
+from analytics.utils.firebase_fns import get_user_details
+from analytics.utils.aggregates import token_aggregate_row, referral_aggregate_row
+from analytics.utils.async_firebase_fns import get_token_transactions, get_user_referral_data, scan_token_history, scan_referrals
+from enterprise.financial_agent.tools.redis.redis_cache import RedisCache
+from firestore.async_repository import spawn, get_documents
+from firestore.db import get_async_db
+
+EXPORT_FILENAME = "admin/files/all_staging_user_details_3.csv"
+EXPORT_DIR = os.getenv("USER_EXPORT_DIR", "tmp/exports")
+# Users being fetched at once, across the whole export
+EXPORT_WORKERS = int(os.getenv("USER_EXPORT_WORKERS", 32))
+# Users read from the stream but not yet written; bounds memory when one user is slow
+EXPORT_MAX_PENDING = EXPORT_WORKERS * 8
+# Users read per query page of the users collection
+EXPORT_PAGE_SIZE = 500
+# Rows written between saved checkpoints
+CHECKPOINT_EVERY = 200
+JOB_EXPIRY = 60 * 60 * 24 * 7
+# A running export stops blocking new ones after this long without a checkpoint,
+# in case the process running it died
+EXPORT_LOCK_TIMEOUT = 60 * 10
+ACTIVE_EXPORT_KEY = "user_export_job_active"
+EXPORT_SOURCES = ("live", "scan", "materialized")
+UPLOAD_READ_SIZE = 1024 * 1024
+# Columns of the export: the union of what every row source produces
+USER_EXPORT_COLUMNS = [
+    "username", "email", "signup_date", "token_balance",
+    "token_usage_count", "token_purchase_count", "token_purchase_history", "last_token_usage", "last_token_purchase",
+    "referrer_id", "referrer_email", "no_of_referrals", "latest_referral_date", "last_referred_user_id", "last_referred_user_email",
+    "user_id",
+]
+
+
+class InvalidExportSource(Exception):
+    pass
+
+
+class ExportNotFound(Exception):
+    pass
+
+
+class ExportStatus:
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def _job_key(job_id):
+    return f"user_export_job:{job_id}"
+
+
+def get_export_job(job_id: str):
+    return RedisCache().get_cache(_job_key(job_id))
+
+
+def public_job(job):
+    """The job as shown to API clients, without the server's local file path."""
+    return {key: value for key, value in job.items() if key != "path"}
+
+
+def _update_job(cache, job, **fields):
+    job.update(fields, updated_at=_now())
+    cache.set_cache(_job_key(job["job_id"]), job, expiry_time=JOB_EXPIRY)
+    if job["status"] == ExportStatus.RUNNING:
+        # Each checkpoint keeps this export marked as the active one
+        cache.set_cache(ACTIVE_EXPORT_KEY, job["job_id"], expiry_time=EXPORT_LOCK_TIMEOUT)
+    return job
+
+
+def start_user_export(resume_job_id: str = None, source: str = "live", gzip_compress: bool = False):
+    """
+    Starts the all-users CSV export in the background, or resumes a failed one
+    from its last checkpoint. Only one export runs at a time; while one is
+    running its job is returned instead.
+
+    source is where token and referral columns come from: "live" queries each
+    user's histories, "scan" reads them with collection-group scans and
+    "materialized" reads the aggregates kept by analytics.materialize.
+    With gzip_compress the CSV is stored gzipped.
+
+    Returns:
+        tuple: (job, started) where started is False if an export was already running.
+    """
+    if source not in EXPORT_SOURCES:
+        raise InvalidExportSource(f"source must be one of: {', '.join(EXPORT_SOURCES)}")
+    cache = RedisCache()
+    job_id = resume_job_id or str(uuid.uuid4())
+
+    if not cache.set_if_absent(ACTIVE_EXPORT_KEY, job_id, expiry_time=EXPORT_LOCK_TIMEOUT):
+        active = get_export_job(cache.get_cache(ACTIVE_EXPORT_KEY) or "")
+        if active is not None and active["status"] in (ExportStatus.QUEUED, ExportStatus.RUNNING):
+            return active, False
+        # The marker outlived its export; take it over
+        cache.set_cache(ACTIVE_EXPORT_KEY, job_id, expiry_time=EXPORT_LOCK_TIMEOUT)
+
+    job = get_export_job(job_id) if resume_job_id else None
+    if resume_job_id and (job is None or job["status"] == ExportStatus.COMPLETED):
+        cache.delete_cache(ACTIVE_EXPORT_KEY)
+        raise ExportNotFound(f"No resumable export {resume_job_id}")
+    if job is None:
+        job = {
+            "job_id": job_id,
+            "status": ExportStatus.QUEUED,
+            "created_at": _now(),
+            "path": os.path.join(EXPORT_DIR, f"{job_id}.csv"),
+            "source": source,
+            "gzip": gzip_compress,
+            "checkpoint": {"last_user_id": None, "rows": 0, "offset": 0, "fieldnames": USER_EXPORT_COLUMNS},
+            "csv_url": None,
+            "error": None,
+        }
+    _update_job(cache, job, status=ExportStatus.QUEUED, error=None)
+
+    spawn(_run_export(job))
+    return job, True
+
+
+def user_key(doc_id, user_data):
+    """
+    The id a user's histories are stored under (users/{id}/...) and the row's
+    user_id: the user_id field, as the live path has always used, falling back
+    to the document id. Every row source joins on it, so they give the same CSV.
+    """
+    return user_data.get('user_id') or doc_id
+
+
+async def get_combined_user_details(user_data, user_id=None):
+    user_id = user_id or user_data.get('user_id')
+
+    # Fetch user details, token details, and referral data concurrently
+    user_details, user_details_err = get_user_details(user_data)
+    (token_details, token_details_err), (referral_data, referral_data_err) = await asyncio.gather(
+        get_token_transactions(user_id), get_user_referral_data(user_id)
+    )
+
+    if user_details_err:
+        print(f"Error fetching user details for user_id {user_id}: {user_details_err}")
+        raise Exception(f"Error fetching user details for user_id {user_id}: {user_details_err}")
+
+    if token_details_err:
+        print(f"Error fetching token details for user_id {user_id}: {token_details_err}")
+        raise Exception(f"Error fetching token details for user_id {user_id}: {token_details_err}")
+
+    if referral_data_err:
+        print(f"Error fetching referral data for user_id {user_id}: {referral_data_err}")
+        raise Exception(f"Error fetching referral data for user_id {user_id}: {referral_data_err}")
+
+    # Combine all responses into a single dictionary
+    return {
+        **user_details,
+        **token_details,
+        **referral_data,
+        "user_id": user_id
+    }
+
+
+async def scan_row_builder():
+    """
+    Scans token_history and referrals once for all users and returns a row
+    builder that joins a user with their aggregates, with no further reads.
+    """
+    (token_aggregates, token_err), (referral_aggregates, referral_err) = await asyncio.gather(
+        scan_token_history(), scan_referrals()
+    )
+    if token_err or referral_err:
+        raise Exception(f"Error scanning user histories: {token_err or referral_err}")
+
+    async def build_row(doc_id, user_data):
+        user_id = user_key(doc_id, user_data)
+        user_details, user_details_err = get_user_details(user_data)
+        if user_details_err:
+            raise Exception(f"Error fetching user details for user_id {user_id}: {user_details_err}")
+        return {
+            **user_details,
+            **token_aggregate_row(token_aggregates.get(user_id)),
+            **referral_aggregate_row(user_data, referral_aggregates.get(user_id)),
+            "user_id": user_id
+        }
+
+    return build_row
+
+
+async def check_materialized():
+    """
+    Fails unless analytics.materialize has built the aggregates, which would
+    otherwise read as every user having no usage or referrals, or when its last
+    run found documents missing from them.
+    """
+    from analytics.materialize import STATE_DOCUMENT, SOURCES
+
+    state = await get_async_db().document(STATE_DOCUMENT).get()
+    built = (state.to_dict() or {}) if state.exists else {}
+    missing = [name for name in SOURCES if not built.get(name)]
+    if missing:
+        raise Exception(f"Materialized {', '.join(missing)} aggregates were never built; run python -m analytics.materialize")
+    late = {name: count for name, count in (built.get("late") or {}).items() if count}
+    if late:
+        raise Exception("Materialized aggregates are missing "
+                        + ", ".join(f"{count} {name} documents" for name, count in late.items())
+                        + "; run python -m analytics.materialize --rebuild")
+
+
+def materialized_row_builder():
+    """
+    Returns a row builder that joins a user with the aggregates kept by
+    analytics.materialize, and a page hook that reads the aggregates of a whole
+    page of users in batched get_all calls before its rows are built.
+    """
+    from analytics.materialize import AGGREGATES_COLLECTION
+
+    # doc_id -> aggregates, for the users read but not yet built
+    prefetched = {}
+
+    async def prefetch(users):
+        paths = {doc_id: f"{AGGREGATES_COLLECTION}/{user_key(doc_id, user_data)}" for doc_id, user_data in users}
+        documents = await get_documents(paths.values())
+        for doc_id, path in paths.items():
+            prefetched[doc_id] = documents.get(path) or {}
+
+    async def build_row(doc_id, user_data):
+        user_id = user_key(doc_id, user_data)
+        user_details, user_details_err = get_user_details(user_data)
+        if user_details_err:
+            raise Exception(f"Error fetching user details for user_id {user_id}: {user_details_err}")
+        aggregates = prefetched.pop(doc_id, {})
+        return {
+            **user_details,
+            **token_aggregate_row(aggregates.get("token")),
+            **referral_aggregate_row(user_data, aggregates.get("referral")),
+            "user_id": user_id
+        }
+
+    return build_row, prefetch
+
+
+async def iter_users(after: str = None, on_page=None):
+    """
+    Yields (document id, user data) for every user in document id order, one
+    query page at a time, starting after the given document id. on_page, if
+    given, is awaited with each page's users before they are yielded.
+    """
+    users_ref = get_async_db().collection(FIRESTORE_COLLECTIONS['USERS'])
+    while True:
+        query = users_ref.order_by('__name__').limit(EXPORT_PAGE_SIZE)
+        if after:
+            query = query.start_after({'__name__': after})
+        page = [user async for user in query.stream()]
+        users = [(user.id, user.to_dict()) for user in page]
+        if on_page and users:
+            await on_page(users)
+        for user in users:
+            yield user
+        if len(page) < EXPORT_PAGE_SIZE:
+            return
+        after = page[-1].id
+
+
+async def _run_export(job):
+    from utils.save_to_storage import open_blob_writer, swap_gcs_to_cdn_url
+
+    cache = RedisCache()
+    _update_job(cache, job, status=ExportStatus.RUNNING)
+    checkpoint = dict(job["checkpoint"])
+    os.makedirs(os.path.dirname(job["path"]), exist_ok=True)
+
+    # Rows past the last checkpoint were never recorded as written, so they are rewritten
+    if checkpoint["offset"] and os.path.exists(job["path"]):
+        csv_file = open(job["path"], "r+", newline="")
+        csv_file.truncate(checkpoint["offset"])
+        csv_file.seek(checkpoint["offset"])
+    else:
+        checkpoint.update(last_user_id=None, rows=0, offset=0, fieldnames=USER_EXPORT_COLUMNS)
+        csv_file = open(job["path"], "w", newline="")
+
+    # A fixed schema, so rows that lack a column (or a resumed job) line up with the header.
+    # Jobs saved before the schema was fixed have no fieldnames in their checkpoint
+    checkpoint["fieldnames"] = checkpoint.get("fieldnames") or USER_EXPORT_COLUMNS
+    writer = csv_writer(csv_file, checkpoint["fieldnames"])
+    if not checkpoint["offset"]:
+        writer.writeheader()
+
+    pending = asyncio.Semaphore(EXPORT_MAX_PENDING)
+    users = asyncio.Queue()
+    finished = {}
+    next_to_write = 0
+
+    def save_checkpoint():
+        csv_file.flush()
+        checkpoint["offset"] = csv_file.tell()
+        _update_job(cache, job, checkpoint=dict(checkpoint))
+
+    def write_finished():
+        # Rows go out in user order, so a checkpoint is a single position in the stream
+        nonlocal next_to_write
+        while next_to_write in finished:
+            doc_id, row = finished.pop(next_to_write)
+            writer.writerow(row)
+            next_to_write += 1
+            pending.release()
+            checkpoint["last_user_id"] = doc_id
+            checkpoint["rows"] += 1
+            if checkpoint["rows"] % CHECKPOINT_EVERY == 0:
+                save_checkpoint()
+
+    async def produce():
+        position = 0
+        async for doc_id, user_data in iter_users(after=checkpoint["last_user_id"], on_page=on_page):
+            await pending.acquire()
+            await users.put((position, doc_id, user_data))
+            position += 1
+        for _ in range(EXPORT_WORKERS):
+            await users.put(None)
+
+    async def work():
+        while (item := await users.get()) is not None:
+            position, doc_id, user_data = item
+            finished[position] = (doc_id, await build_row(doc_id, user_data))
+            write_finished()
+
+    on_page = None
+    try:
+        if job.get("source") == "scan":
+            build_row = await scan_row_builder()
+        elif job.get("source") == "materialized":
+            await check_materialized()
+            build_row, on_page = materialized_row_builder()
+        else:
+            async def build_row(doc_id, user_data):
+                return await get_combined_user_details(user_data, user_key(doc_id, user_data))
+
+        async with asyncio.TaskGroup() as tasks:
+            tasks.create_task(produce())
+            for _ in range(EXPORT_WORKERS):
+                tasks.create_task(work())
+        save_checkpoint()
+        csv_file.close()
+
+        def upload():
+            # Streamed from disk into a resumable upload, a chunk at a time
+            with open(job["path"], "rb") as export_file, \
+                    open_blob_writer(EXPORT_FILENAME, gzip_compress=job.get("gzip", False)) as (upload_stream, blob):
+                shutil.copyfileobj(export_file, upload_stream, UPLOAD_READ_SIZE)
+            return swap_gcs_to_cdn_url(blob.public_url)
+        csv_url = await asyncio.to_thread(upload)
+        _update_job(cache, job, status=ExportStatus.COMPLETED, csv_url=csv_url)
+        os.remove(job["path"])
+    except Exception as e:
+        if isinstance(e, ExceptionGroup):
+            e = e.exceptions[0]
+        print(f"Error exporting user details for job {job['job_id']}: {e}")
+        if not csv_file.closed:
+            save_checkpoint()
+            csv_file.close()
+        _update_job(cache, job, status=ExportStatus.FAILED, error=str(e))
+    finally:
+        if cache.get_cache(ACTIVE_EXPORT_KEY) == job["job_id"]:
+            cache.delete_cache(ACTIVE_EXPORT_KEY)
@@ -0,0 +1,232 @@
+"""
+Keeps a small per-user analytics document (user_analytics/{user_id}) up to date
+with each user's token and referral aggregates, so reports read one document
+per user instead of scanning full histories.
+
+Each run folds in only the token_history and referrals documents dated after
+the watermark left by the previous run, on the dates their writers already
+set (a transaction's timestamp, a referral's signup date). Every page of new
+documents is committed in one transaction together with the advanced
+watermark, so an interrupted run neither loses nor double counts anything.
+
+A document can be written with a date already behind the watermark, and is
+then never folded in. After each run the documents dated behind the watermark
+are counted and compared with how many were folded in; a surplus is printed,
+recorded in the state document, and fails exports of the aggregates until a
+--rebuild.
+
+Usage:
+    python -m analytics.materialize
+    python -m analytics.materialize --loop --interval 900
+    python -m analytics.materialize --rebuild
+"""
+import argparse
+import datetime
+import time
+
+from dotenv import load_dotenv
+from google.cloud import firestore
+
+from analytics.utils.aggregates import (
+    parent_user_id, new_token_aggregate, add_token_transaction, merge_token_aggregates,
+    new_referral_aggregate, add_referral, merge_referral_aggregates,
+)
+from analytics.utils.constants import FIRESTORE_SUBCOLLECTIONS
+from analytics.utils.firebase_fns import TOKEN_TXN_FIELDS
+from firestore.db import get_db
+
+load_dotenv()
+
+AGGREGATES_COLLECTION = "user_analytics"
+STATE_DOCUMENT = "analytics_state/user_aggregates"
+# Documents folded in per transaction; each touches at most this many user
+# documents plus the state document, inside Firestore's 500 writes
+PAGE_SIZE = 400
+# Documents dated within this many seconds of now are left for the next run,
+# so commits still becoming visible are not skipped
+SAFETY_LAG = 60
+
+# Histories folded into the aggregates: the subcollection, the date the
+# watermark follows, the fields read, and how its documents fold into an aggregate
+SOURCES = {
+    "token": {
+        "collection": FIRESTORE_SUBCOLLECTIONS['USERS']['TOKEN_HISTORY'],
+        "time_field": "timestamp",
+        "fields": TOKEN_TXN_FIELDS,
+        "new": new_token_aggregate,
+        "add": add_token_transaction,
+        "merge": merge_token_aggregates,
+    },
+    "referral": {
+        "collection": FIRESTORE_SUBCOLLECTIONS['USERS']['REFERRALS'],
+        "time_field": "referred_user_signup_date",
+        "fields": ["referred_user_id", "referred_user_email", "referred_user_signup_date", "bonus_received"],
+        "new": new_referral_aggregate,
+        "add": add_referral,
+        "merge": merge_referral_aggregates,
+    },
+}
+
+
+class ConcurrentRunError(Exception):
+    pass
+
+
+class StaleWatermarkError(Exception):
+    pass
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def get_user_aggregates(user_id: str):
+    """The materialized aggregates of a user, or None if none were built yet."""
+    snapshot = get_db().collection(AGGREGATES_COLLECTION).document(user_id).get()
+    return snapshot.to_dict() if snapshot.exists else None
+
+
+def _new_watermark(name):
+    # folded counts every document folded in so far, to tell late documents apart
+    return {"field": SOURCES[name]["time_field"], "value": None, "ids": [], "folded": 0}
+
+
+def _watermark(db, name):
+    state = db.document(STATE_DOCUMENT).get()
+    watermark = ((state.to_dict() or {}) if state.exists else {}).get(name) or _new_watermark(name)
+    if watermark.get("field") != SOURCES[name]["time_field"] or "folded" not in watermark:
+        # Positions on another field say nothing about which documents were counted
+        raise StaleWatermarkError(
+            f"The {name} watermark is on {watermark.get('field') or 'an old time field'}; run with --rebuild")
+    return watermark
+
+
+@firestore.transactional
+def _commit_page(transaction, db, name, expected, watermark, deltas):
+    state_ref = db.document(STATE_DOCUMENT)
+    state = state_ref.get(transaction=transaction)
+    current = ((state.to_dict() or {}) if state.exists else {}).get(name) or _new_watermark(name)
+    if current != expected:
+        raise ConcurrentRunError(f"The {name} watermark moved; another run is in progress")
+
+    source = SOURCES[name]
+    refs = [db.collection(AGGREGATES_COLLECTION).document(user_id) for user_id in deltas]
+    stored = {snapshot.id: (snapshot.to_dict() or {}) for snapshot in db.get_all(refs, transaction=transaction)}
+    updated_at = _now().isoformat()
+    for ref in refs:
+        merged = source["merge"](stored.get(ref.id, {}).get(name), deltas[ref.id])
+        transaction.set(ref, {name: merged, "updated_at": updated_at}, merge=True)
+    transaction.set(state_ref, {name: watermark, "updated_at": updated_at}, merge=True)
+
+
+def count_late_documents(db, name, watermark) -> int:
+    """
+    Counts the documents of one history dated behind its watermark that were
+    never folded in, from an aggregation query rather than reading them.
+    """
+    if not watermark["value"]:
+        return 0
+    query = db.collection_group(SOURCES[name]["collection"]).where(SOURCES[name]["time_field"], "<", watermark["value"])
+    behind = query.count().get()[0][0].value
+    # The documents at exactly the watermark's date are the last ones folded in
+    difference = behind - (watermark["folded"] - len(watermark["ids"]))
+    if difference < 0:
+        print(f"{-difference} {name} documents folded into the aggregates were since deleted; run with --rebuild to drop them")
+    return max(difference, 0)
+
+
+def refresh_source(name: str) -> dict:
+    """
+    Folds the documents of one history newer than its watermark into the
+    aggregates. Returns how many documents were folded in, and how many are
+    dated behind the watermark and were missed.
+    """
+    db = get_db()
+    source = SOURCES[name]
+    time_field = source["time_field"]
+    cutoff = (_now() - datetime.timedelta(seconds=SAFETY_LAG)).isoformat()
+    watermark = _watermark(db, name)
+
+    # >= the watermark, skipping the documents already folded in at exactly that time
+    query = db.collection_group(source["collection"]).where(time_field, "<", cutoff)
+    if watermark["value"]:
+        query = query.where(time_field, ">=", watermark["value"])
+    query = query.order_by(time_field).select(source["fields"]).limit(PAGE_SIZE)
+
+    folded = 0
+    last_snapshot = None
+    while True:
+        page = list((query.start_after(last_snapshot) if last_snapshot else query).stream())
+        deltas = {}
+        next_watermark = dict(watermark, ids=list(watermark["ids"]))
+        seen = set(watermark["ids"])
+        for snapshot in page:
+            data = snapshot.to_dict()
+            path = snapshot.reference.path
+            if path in seen:
+                continue
+            user_id = parent_user_id(snapshot)
+            if user_id:
+                source["add"](deltas.setdefault(user_id, source["new"]()), data)
+            if data[time_field] != next_watermark["value"]:
+                next_watermark = dict(_new_watermark(name), value=data[time_field], folded=next_watermark["folded"])
+            next_watermark["ids"].append(path)
+            next_watermark["folded"] += 1
+            folded += 1
+
+        if next_watermark != watermark:
+            _commit_page(db.transaction(), db, name, watermark, next_watermark, deltas)
+            watermark = next_watermark
+        if len(page) < PAGE_SIZE:
+            break
+        last_snapshot = page[-1]
+
+    late = count_late_documents(db, name, watermark)
+    if late:
+        print(f"{late} {name} documents are dated behind the watermark and missing from the aggregates; run with --rebuild")
+    db.document(STATE_DOCUMENT).set({"late": {name: late}}, merge=True)
+    return {"folded": folded, "late": late}
+
+
+def refresh_user_aggregates():
+    """Brings every user's aggregates up to date. Returns the documents folded in and missed per history."""
+    return {name: refresh_source(name) for name in SOURCES}
+
+
+def reset_user_aggregates():
+    """Deletes the aggregates and their watermarks, so the next run rebuilds them from scratch."""
+    db = get_db()
+    while True:
+        snapshots = list(db.collection(AGGREGATES_COLLECTION).select(["updated_at"]).limit(500).stream())
+        if not snapshots:
+            break
+        batch = db.batch()
+        for snapshot in snapshots:
+            batch.delete(snapshot.reference)
+        batch.commit()
+    db.document(STATE_DOCUMENT).delete()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Update the materialized per-user analytics aggregates.")
+    parser.add_argument("--rebuild", action="store_true", help="Drop the aggregates and rebuild them from the full histories.")
+    parser.add_argument("--loop", action="store_true", help="Keep running, refreshing every --interval seconds.")
+    parser.add_argument("--interval", type=int, default=900, help="Seconds between refreshes in --loop mode.")
+    args = parser.parse_args(argv)
+
+    if args.rebuild:
+        print("Dropping materialized user aggregates")
+        reset_user_aggregates()
+
+    while True:
+        started = time.monotonic()
+        counts = refresh_user_aggregates()
+        print(f"Aggregates refreshed in {time.monotonic() - started:.1f}s: "
+              + ", ".join(f"{count['folded']} {name} documents ({count['late']} late)" for name, count in counts.items()))
+        if not args.loop:
+            return counts
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
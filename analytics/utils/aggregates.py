@@ -0,0 +1,136 @@
+from typing import Dict, Optional
+from analytics.utils.constants import FIRESTORE_COLLECTIONS
+from analytics.utils.firebase_fns import TokenTxnType, format_date, token_transaction_row
+
+
+def parent_user_id(snapshot) -> Optional[str]:
+    """
+    The user a users/{user_id}/<subcollection>/{doc} snapshot belongs to, or
+    None for a collection-group match under some other parent.
+    """
+    user_ref = snapshot.reference.parent.parent
+    if user_ref is None or user_ref.parent.id != FIRESTORE_COLLECTIONS['USERS']:
+        return None
+    return user_ref.id
+
+
+def new_token_aggregate() -> Dict:
+    return {
+        "usage_amount": 0,
+        "purchase_amount": 0,
+        "purchases": [],
+        "last_usage": None,
+        "last_purchase": None,
+    }
+
+
+def add_token_transaction(aggregate: Dict, txn_data: Dict) -> Dict:
+    """
+    Folds one token_history document into a user's token aggregate.
+    """
+    txn_type = txn_data.get("txn_type")
+    timestamp = txn_data.get("timestamp")
+    if txn_type == TokenTxnType.TOKEN_USAGE.value:
+        aggregate["usage_amount"] += txn_data.get("amount") or 0
+        if timestamp and (aggregate["last_usage"] is None or timestamp > aggregate["last_usage"]):
+            aggregate["last_usage"] = timestamp
+    elif txn_type == TokenTxnType.TOKEN_PURCHASE.value:
+        aggregate["purchase_amount"] += txn_data.get("amount") or 0
+        aggregate["purchases"].append(token_transaction_row(txn_data))
+        if timestamp and (aggregate["last_purchase"] is None or timestamp > aggregate["last_purchase"]):
+            aggregate["last_purchase"] = timestamp
+    return aggregate
+
+
+def merge_token_aggregates(aggregate: Optional[Dict], delta: Dict) -> Dict:
+    """
+    Adds the aggregate of newer transactions (delta) onto a stored aggregate.
+    """
+    merged = dict(aggregate or new_token_aggregate())
+    merged["usage_amount"] += delta["usage_amount"]
+    merged["purchase_amount"] += delta["purchase_amount"]
+    merged["purchases"] = list(merged["purchases"]) + delta["purchases"]
+    for field in ("last_usage", "last_purchase"):
+        if delta[field] and (merged[field] is None or delta[field] > merged[field]):
+            merged[field] = delta[field]
+    return merged
+
+
+def token_aggregate_row(aggregate: Optional[Dict]) -> Dict:
+    """
+    Token columns of the user report, the same as summarize_token_transactions gives.
+    """
+    aggregate = aggregate or new_token_aggregate()
+    return {
+        "token_usage_count": abs(aggregate["usage_amount"]),
+        "token_purchase_count": aggregate["purchase_amount"],
+        "token_purchase_history": sorted(aggregate["purchases"], key=lambda txn: txn.get("timestamp") or "", reverse=True),
+        "last_token_usage": format_date(aggregate["last_usage"]),
+        "last_token_purchase": format_date(aggregate["last_purchase"]),
+    }
+
+
+def new_referral_aggregate() -> Dict:
+    return {
+        "total_referrals": 0,
+        "total_tokens_earned": 0,
+        "latest_referral": None,
+    }
+
+
+def add_referral(aggregate: Dict, referral_data: Dict) -> Dict:
+    """
+    Folds one referrals document into a user's referral aggregate.
+    """
+    aggregate["total_referrals"] += 1
+    aggregate["total_tokens_earned"] += referral_data.get("bonus_received") or 0
+    latest = aggregate["latest_referral"]
+    signup_date = referral_data.get("referred_user_signup_date") or ""
+    if latest is None or signup_date > (latest["signup_date"] or ""):
+        aggregate["latest_referral"] = {
+            "user_id": referral_data.get("referred_user_id"),
+            "email": referral_data.get("referred_user_email"),
+            "signup_date": referral_data.get("referred_user_signup_date"),
+        }
+    return aggregate
+
+
+def merge_referral_aggregates(aggregate: Optional[Dict], delta: Dict) -> Dict:
+    """
+    Adds the aggregate of newer referrals (delta) onto a stored aggregate.
+    """
+    merged = dict(aggregate or new_referral_aggregate())
+    merged["total_referrals"] += delta["total_referrals"]
+    merged["total_tokens_earned"] += delta["total_tokens_earned"]
+    latest, newer = merged["latest_referral"], delta["latest_referral"]
+    if newer and (latest is None or (newer["signup_date"] or "") > (latest["signup_date"] or "")):
+        merged["latest_referral"] = newer
+    return merged
+
+
+def referral_aggregate_row(user_data: Dict, aggregate: Optional[Dict]) -> Dict:
+    """
+    Referral columns of the user report, the same as get_user_referral_data gives.
+    """
+    referral_details = (user_data or {}).get("referral_details")
+    if not referral_details:
+        # get_user_referral_data reports a user without referral details as having none
+        return {
+            "referrer_id": None,
+            "referrer_email": None,
+            "no_of_referrals": 0,
+            "latest_referral_date": None,
+            "last_referred_user_id": None,
+            "last_referred_user_email": None
+        }
+
+    aggregate = aggregate or new_referral_aggregate()
+    latest = aggregate["latest_referral"] or {}
+    return {
+        "referrer_id": referral_details.get("referred_by_id"),
+        "referrer_email": referral_details.get("referred_by_email"),
+        "no_of_referrals": aggregate["total_referrals"],
+        "latest_referral_date": format_date(latest.get("signup_date")),
+        "last_referred_user_id": latest.get("user_id"),
+        "last_referred_user_email": latest.get("email"),
+    }
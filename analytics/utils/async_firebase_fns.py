@@ -0,0 +1,189 @@
+"""
+Async counterparts of analytics.utils.firebase_fns on the Firestore AsyncClient,
+with the same signatures and return values, for fan-outs over many users, and
+collection-group scans that aggregate every user's history at once.
+"""
+import asyncio
+from typing import Tuple, List, Dict, Optional
+from google.cloud import firestore
+from analytics.utils.constants import FIRESTORE_COLLECTIONS, FIRESTORE_SUBCOLLECTIONS
+from analytics.utils.firebase_fns import (
+    build_referral_data, token_transaction_row, summarize_referral_data, summarize_token_transactions,
+    TOKEN_TXN_FIELDS, MAX_TOKEN_PAGE_SIZE,
+)
+from analytics.utils.aggregates import parent_user_id, add_token_transaction, new_token_aggregate, add_referral, new_referral_aggregate
+from firestore.async_repository import scan_collection_group
+from firestore.db import get_async_db
+
+
+async def get_referral_data(user_id: str) -> Tuple[Optional[Dict], Optional[str]]:
+    """
+    Get referral data for a user. The user document and the referrals are read concurrently.
+
+    :param user_id: The ID of the user
+    :return: Tuple (Dict containing referral data, Optional[str] error message)
+    """
+    try:
+        db = get_async_db()
+        user_ref = db.collection(FIRESTORE_COLLECTIONS['USERS']).document(user_id)
+        referrals_ref = user_ref.collection(FIRESTORE_SUBCOLLECTIONS['USERS']['REFERRALS'])
+
+        async def get_referrals():
+            return [referral.to_dict() async for referral in referrals_ref.stream()]
+
+        user_snapshot, referrals = await asyncio.gather(user_ref.get(), get_referrals())
+        user_data = user_snapshot.to_dict()
+
+        if not user_data:
+            return None, f"User with ID {user_id} not found"
+
+        return build_referral_data(user_data, referrals), None
+    except Exception as e:
+        print(f"Error retrieving referral data: {str(e)}")
+        return None, str(e)
+
+
+async def get_user_token_transactions(user_id: str, page_size: int = 10, start_after_key: Optional[str] = None, fields: Optional[List[str]] = TOKEN_TXN_FIELDS) -> Tuple[List[Dict], Optional[str], Optional[str]]:
+    """
+    Get the token transactions for a user with pagination.
+
+    :param user_id: The ID of the user to retrieve the token transactions
+    :param page_size: Number of transactions to return per page, at most MAX_TOKEN_PAGE_SIZE
+    :param start_after_key: next_page_key of the previous page (the id of its last transaction)
+    :param fields: Fields to read from each transaction, or None for whole documents
+    :return: Tuple (token transactions, next_page_key, error_message)
+    """
+    try:
+        db = get_async_db()
+        token_history_ref = (
+            db.collection(FIRESTORE_COLLECTIONS['USERS']).document(user_id)
+            .collection(FIRESTORE_SUBCOLLECTIONS['USERS']['TOKEN_HISTORY'])
+        )
+        page_size = max(1, min(page_size, MAX_TOKEN_PAGE_SIZE))
+        query = token_history_ref.order_by('timestamp', direction=firestore.Query.DESCENDING)
+        if fields:
+            query = query.select(fields)
+
+        if start_after_key:
+            start_doc = await token_history_ref.document(start_after_key).get(field_paths=['timestamp'])
+            if start_doc.exists:
+                query = query.start_after(start_doc)
+
+        docs = [doc async for doc in query.limit(page_size + 1).stream()]
+        transactions = [token_transaction_row(doc.to_dict()) for doc in docs[:page_size]]
+        next_cursor = docs[page_size - 1].id if len(docs) > page_size else None
+        return transactions, next_cursor, None
+    except Exception as e:
+        print(f"Error fetching token transactions for user {user_id}: {str(e)}")
+        return [], None, str(e)
+
+
+async def stream_all_user_data() -> Tuple[Optional[list], Optional[str]]:
+    """
+    Stream all user data from the Firestore database.
+
+    :return: Tuple (list of user data, error_message)
+    """
+    try:
+        db = get_async_db()
+        return [user.to_dict() async for user in db.collection(FIRESTORE_COLLECTIONS['USERS']).stream()], None
+    except Exception as e:
+        print(f"Error streaming all user data: {str(e)}")
+        return None, str(e)
+
+
+async def get_user_referral_data(user_id: str) -> Tuple[Dict, Optional[str]]:
+    """
+    Get referral data for a user.
+
+    :param user_id: The ID of the user
+    :return: Tuple (Dict containing referral data, Optional[str] error message)
+    """
+    try:
+        referral_data, _ = await get_referral_data(user_id)
+
+        if not referral_data:
+            return {
+                "referrer_id": None,
+                "referrer_email": None,
+                "no_of_referrals": 0,
+                "latest_referral_date": None,
+                "last_referred_user_id": None,
+                "last_referred_user_email": None
+            }, None
+
+        return summarize_referral_data(referral_data), None
+    except Exception as e:
+        return None, f"Error retrieving referral data: {str(e)}"
+
+
+async def get_token_transactions(user_id: str) -> Tuple[Dict, Optional[str]]:
+    """
+    Get token transactions for a user. All of them are read in one streamed
+    query rather than page by page.
+
+    :param user_id: The ID of the user
+    :return: Tuple (List of token transactions, Optional[str] error message)
+    """
+    try:
+        db = get_async_db()
+        query = (
+            db.collection(FIRESTORE_COLLECTIONS['USERS']).document(user_id)
+            .collection(FIRESTORE_SUBCOLLECTIONS['USERS']['TOKEN_HISTORY'])
+            .order_by('timestamp', direction=firestore.Query.DESCENDING)
+            .select(TOKEN_TXN_FIELDS)
+        )
+        token_transactions = [token_transaction_row(doc.to_dict()) async for doc in query.stream()]
+        return summarize_token_transactions(token_transactions), None
+    except Exception as e:
+        return None, f"Error retrieving token transactions: {str(e)}"
+
+
+async def scan_token_history() -> Tuple[Optional[Dict], Optional[str]]:
+    """
+    Token aggregates of every user from one partitioned collection-group scan
+    of token_history, instead of paging each user's subcollection.
+
+    :return: Tuple (Dict of user_id to token aggregate, Optional[str] error message)
+    """
+    try:
+        aggregates = {}
+
+        def handle(snapshot):
+            user_id = parent_user_id(snapshot)
+            if user_id:
+                add_token_transaction(aggregates.setdefault(user_id, new_token_aggregate()), snapshot.to_dict())
+
+        await scan_collection_group(
+            FIRESTORE_SUBCOLLECTIONS['USERS']['TOKEN_HISTORY'], handle,
+            field_paths=TOKEN_TXN_FIELDS,
+        )
+        return aggregates, None
+    except Exception as e:
+        print(f"Error scanning token history: {str(e)}")
+        return None, str(e)
+
+
+async def scan_referrals() -> Tuple[Optional[Dict], Optional[str]]:
+    """
+    Referral aggregates of every user from one partitioned collection-group
+    scan of referrals.
+
+    :return: Tuple (Dict of user_id to referral aggregate, Optional[str] error message)
+    """
+    try:
+        aggregates = {}
+
+        def handle(snapshot):
+            user_id = parent_user_id(snapshot)
+            if user_id:
+                add_referral(aggregates.setdefault(user_id, new_referral_aggregate()), snapshot.to_dict())
+
+        await scan_collection_group(
+            FIRESTORE_SUBCOLLECTIONS['USERS']['REFERRALS'], handle,
+            field_paths=["referred_user_id", "referred_user_email", "referred_user_signup_date", "bonus_received"],
+        )
+        return aggregates, None
+    except Exception as e:
+        print(f"Error scanning referrals: {str(e)}")
+        return None, str(e)
@@ -1,6 +1,45 @@
 from typing import Tuple, List, Dict, Optional
 from firebase_admin import firestore
 from analytics.utils.constants import FIRESTORE_COLLECTIONS, FIRESTORE_SUBCOLLECTIONS
+from firestore.db import get_db
+
+
+def build_referral_data(user_data: Dict, referrals) -> Dict:
+    """
+    Referral summary of a user from their document and referral documents.
+    """
+    total_referrals = 0
+    tokens_earned = 0
+    referral_history = []
+
+    for referral_data in referrals:
+        total_referrals += 1
+        tokens_earned += referral_data['bonus_received']
+        
+        referral_history.append({
+            'user_id': referral_data['referred_user_id'],
+            'email': referral_data['referred_user_email'],
+            'signup_date': referral_data['referred_user_signup_date'],
+            'bonus_received': referral_data['bonus_received']
+        })
+
+    return {
+        'total_referrals': total_referrals,
+        'total_tokens_earned': tokens_earned,
+        'referred_by_id': user_data['referral_details']['referred_by_id'],
+        'referred_by_email': user_data['referral_details']['referred_by_email'],
+        'referral_code': user_data['referral_details']['referral_code'],
+        'referral_history': referral_history
+    }
+
+
+def token_transaction_row(txn_data: Dict) -> Dict:
+    return {
+        "txn_id": txn_data.get("txn_id"),
+        "txn_type": txn_data.get("txn_type"),
+        "amount": txn_data.get("amount"),
+        "timestamp": txn_data.get("timestamp")
+    }
 
 
 def get_referral_data(user_id: str) -> Tuple[Optional[Dict], Optional[str]]:
@@ -11,7 +50,7 @@ def get_referral_data(user_id: str) -> Tuple[Optional[Dict], Optional[str]]:
     :return: Tuple (Dict containing referral data, Optional[str] error message)
     """
     try:
-        from app import db
+        db = get_db()
         user_ref = db.collection(FIRESTORE_COLLECTIONS['USERS']).document(user_id)
         
         # Fetch user document
@@ -20,38 +59,9 @@ def get_referral_data(user_id: str) -> Tuple[Optional[Dict], Optional[str]]:
         if not user_data:
             return None, f"User with ID {user_id} not found"
         
-        referral_code = user_data['referral_details']['referral_code']
-        referred_by = user_data['referral_details']['referred_by_id']
-        referred_by_email = user_data['referral_details']['referred_by_email']
-        
         # Fetch all referral documents
         referrals_ref = user_ref.collection(FIRESTORE_SUBCOLLECTIONS['USERS']['REFERRALS'])
-        referrals_snapshot = referrals_ref.stream()
-
-        total_referrals = 0
-        tokens_earned = 0
-        referral_history = []
-
-        for referral in referrals_snapshot:
-            referral_data = referral.to_dict()
-            total_referrals += 1
-            tokens_earned += referral_data['bonus_received']
-            
-            referral_history.append({
-                'user_id': referral_data['referred_user_id'],
-                'email': referral_data['referred_user_email'],
-                'signup_date': referral_data['referred_user_signup_date'],
-                'bonus_received': referral_data['bonus_received']
-            })
-
-        referral_data = {
-            'total_referrals': total_referrals,
-            'total_tokens_earned': tokens_earned,
-            'referred_by_id': referred_by,
-            'referred_by_email': referred_by_email,
-            'referral_code': referral_code,
-            'referral_history': referral_history
-        }
+        referral_data = build_referral_data(user_data, (referral.to_dict() for referral in referrals_ref.stream()))
 
         return referral_data, None
     except Exception as e:
@@ -59,58 +69,76 @@ def get_referral_data(user_id: str) -> Tuple[Optional[Dict], Optional[str]]:
         return None, str(e)
     
 
-def get_user_token_transactions(user_id: str, page_size: int = 10, start_after_key: Optional[str] = None) -> Tuple[List[Dict], Optional[str], Optional[str]]:
+# The token_history fields the reports use
+TOKEN_TXN_FIELDS = ["txn_id", "txn_type", "amount", "timestamp"]
+# Largest page read from a token_history, for bulk jobs
+MAX_TOKEN_PAGE_SIZE = 500
+
+
+def _token_history_query(token_history_ref, fields: Optional[List[str]]):
+    query = token_history_ref.order_by('timestamp', direction=firestore.Query.DESCENDING)
+    return query.select(fields) if fields else query
+
+
+def get_user_token_transactions(user_id: str, page_size: int = 10, start_after_key: Optional[str] = None, fields: Optional[List[str]] = TOKEN_TXN_FIELDS) -> Tuple[List[Dict], Optional[str], Optional[str]]:
     """
     Get the token transactions for a user with pagination.
 
     :param user_id: The ID of the user to retrieve the token transactions
-    :param page_size: Number of transactions to return per page
-    :param start_after_key: Key to start after for pagination
+    :param page_size: Number of transactions to return per page, at most MAX_TOKEN_PAGE_SIZE
+    :param start_after_key: next_page_key of the previous page (the id of its last transaction)
+    :param fields: Fields to read from each transaction, or None for whole documents
     :return: Tuple (token transactions, next_page_key, error_message)
     """
     try:
-        from app import db
+        db = get_db()
         user_ref = db.collection(FIRESTORE_COLLECTIONS['USERS']).document(user_id)
         token_history_ref = user_ref.collection(FIRESTORE_SUBCOLLECTIONS['USERS']['TOKEN_HISTORY'])
+        page_size = max(1, min(page_size, MAX_TOKEN_PAGE_SIZE))
         
         # Build the query
-        query = token_history_ref.order_by('timestamp', direction=firestore.Query.DESCENDING)
+        query = _token_history_query(token_history_ref, fields)
         
-        # Add pagination if we have a cursor
+        # Add pagination if we have a cursor; only its sort field is needed
         if start_after_key:
-            start_doc = token_history_ref.document(start_after_key).get()
+            start_doc = token_history_ref.document(start_after_key).get(field_paths=['timestamp'])
             if start_doc.exists:
-                query = query.start_at(start_doc)
-                
-        query = query.limit(page_size + 1)  # Get one extra to check if there's a next page
-
-        # Execute query
-        docs = query.stream()
-        transactions = []
-        next_cursor = None
-
-        for i, doc in enumerate(docs):
-            # If this is the extra document, just use it for the cursor
-            if i == page_size:
-                next_cursor = doc.id
-                break
-                
-            txn_data = doc.to_dict()
-            transactions.append({
-                "txn_id": txn_data.get("txn_id"),
-                "txn_type": txn_data.get("txn_type"),
-                "amount": txn_data.get("amount"),
-                "timestamp": txn_data.get("timestamp")
-            })
+                query = query.start_after(start_doc)
+
+        # Get one extra to check if there's a next page
+        docs = list(query.limit(page_size + 1).stream())
+        transactions = [token_transaction_row(doc.to_dict()) for doc in docs[:page_size]]
+        next_cursor = docs[page_size - 1].id if len(docs) > page_size else None
 
         return transactions, next_cursor, None
     except Exception as e:
         print(f"Error fetching token transactions for user {user_id}: {str(e)}")
         return [], None, str(e)
-    
 
 
-    
+def iter_user_token_transaction_pages(user_id: str, page_size: int = MAX_TOKEN_PAGE_SIZE, fields: Optional[List[str]] = TOKEN_TXN_FIELDS):
+    """
+    Yields all of a user's token transactions a page at a time. Each page starts
+    after the last snapshot of the previous one, so paging costs no extra reads.
+    """
+    db = get_db()
+    token_history_ref = (
+        db.collection(FIRESTORE_COLLECTIONS['USERS']).document(user_id)
+        .collection(FIRESTORE_SUBCOLLECTIONS['USERS']['TOKEN_HISTORY'])
+    )
+    query = _token_history_query(token_history_ref, fields)
+    page_size = max(1, min(page_size, MAX_TOKEN_PAGE_SIZE))
+    last_doc = None
+    while True:
+        page_query = query.start_after(last_doc) if last_doc else query
+        docs = list(page_query.limit(page_size).stream())
+        if docs:
+            yield [token_transaction_row(doc.to_dict()) for doc in docs]
+        if len(docs) < page_size:
+            return
+        last_doc = docs[-1]
+
+
 def stream_all_user_data() -> Tuple[Optional[list], Optional[str]]:
     """
     Stream all user data from the Firestore database.
@@ -118,7 +146,7 @@ def stream_all_user_data() -> Tuple[Optional[list], Optional[str]]:
     :return: Tuple (list of user data, error_message)
     """
     try:
-        from app import db
+        db = get_db()
         users_ref = db.collection(FIRESTORE_COLLECTIONS['USERS'])
         users_snapshot = users_ref.stream()
         return [user.to_dict() for user in users_snapshot], None
@@ -166,6 +194,35 @@ def format_date(iso_date: str) -> str | None:
 from typing import Tuple, Dict, Optional
 
 
+def summarize_referral_data(referral_data: Dict) -> Dict:
+    """
+    Referral columns of the user report, from get_referral_data's result.
+    """
+    no_of_referrals = referral_data.get('total_referrals', 0)
+    referrer_id = referral_data.get('referred_by_id')
+    referrer_email = referral_data.get('referred_by_email')
+    
+    referral_history = referral_data.get('referral_history', [])
+    latest_referral_date = None
+    last_referred_user_id = None 
+    last_referred_user_email = None
+
+    if referral_history:
+        latest_referral = max(referral_history, key=lambda ref: ref.get('signup_date', ''))
+        latest_referral_date = latest_referral.get('signup_date')
+        last_referred_user_id = latest_referral.get('user_id')
+        last_referred_user_email = latest_referral.get('email')
+
+    return {
+        "referrer_id": referrer_id,
+        "referrer_email": referrer_email,
+        "no_of_referrals": no_of_referrals,
+        "latest_referral_date": format_date(latest_referral_date),
+        "last_referred_user_id": last_referred_user_id,
+        "last_referred_user_email": last_referred_user_email,
+    }
+
+
 def get_user_referral_data(user_id: str) -> Tuple[Dict, Optional[str]]:
     """
     Get referral data for a user.
@@ -187,29 +244,7 @@ def get_user_referral_data(user_id: str) -> Tuple[Dict, Optional[str]]:
                 "last_referred_user_email": None
             }, None
 
-        no_of_referrals = referral_data.get('total_referrals', 0)
-        referrer_id = referral_data.get('referred_by_id')
-        referrer_email = referral_data.get('referred_by_email')
-        
-        referral_history = referral_data.get('referral_history', [])
-        latest_referral_date = None
-        last_referred_user_id = None 
-        last_referred_user_email = None
-
-        if referral_history:
-            latest_referral = max(referral_history, key=lambda ref: ref.get('signup_date', ''))
-            latest_referral_date = latest_referral.get('signup_date')
-            last_referred_user_id = latest_referral.get('user_id')
-            last_referred_user_email = latest_referral.get('email')
-
-        return {
-            "referrer_id": referrer_id,
-            "referrer_email": referrer_email,
-            "no_of_referrals": no_of_referrals,
-            "latest_referral_date": format_date(latest_referral_date),
-            "last_referred_user_id": last_referred_user_id,
-            "last_referred_user_email": last_referred_user_email,
-        }, None
+        return summarize_referral_data(referral_data), None
 
     except Exception as e:
         return None, f"Error retrieving referral data: {str(e)}"
@@ -217,6 +252,34 @@ def get_user_referral_data(user_id: str) -> Tuple[Dict, Optional[str]]:
 from typing import Tuple, Dict, Optional
 
 
+def summarize_token_transactions(token_transactions: List[Dict]) -> Dict:
+    """
+    Token columns of the user report, from all of a user's token transactions.
+    """
+    # Split transactions by type for more efficient processing
+    usage_txns = []
+    purchase_txns = []
+    for txn in token_transactions:
+        if txn['txn_type'] == TokenTxnType.TOKEN_USAGE.value:
+            usage_txns.append(txn)
+        elif txn['txn_type'] == TokenTxnType.TOKEN_PURCHASE.value:
+            purchase_txns.append(txn)
+
+    # Calculate metrics in single pass through filtered lists
+    token_usage_count = abs(sum(txn['amount'] for txn in usage_txns))
+    token_purchase_count = sum(txn['amount'] for txn in purchase_txns)
+    last_token_usage = max((txn['timestamp'] for txn in usage_txns), default=None)
+    last_token_purchase = max((txn['timestamp'] for txn in purchase_txns), default=None)
+
+    return {
+        "token_usage_count": token_usage_count,
+        "token_purchase_count": token_purchase_count,
+        "token_purchase_history": purchase_txns,
+        "last_token_usage": format_date(last_token_usage), 
+        "last_token_purchase": format_date(last_token_purchase),
+    }
+
+
 def get_token_transactions(user_id: str) -> Tuple[Dict, Optional[str]]:
     """
     Get token transactions for a user.
@@ -225,39 +288,10 @@ def get_token_transactions(user_id: str) -> Tuple[Dict, Optional[str]]:
     :return: Tuple (List of token transactions, Optional[str] error message)
     """
     try:
-        token_transactions = []
-        page_token = None
-
         # Fetch all token transactions for the user
-        while True:
-            transactions, next_page_token, _ = get_user_token_transactions(user_id, page_size=100, start_after_key=page_token)
-            token_transactions.extend(transactions)
-            if not next_page_token or next_page_token == page_token:
-                break
-            page_token = next_page_token
-
-        # Split transactions by type for more efficient processing
-        usage_txns = []
-        purchase_txns = []
-        for txn in token_transactions:
-            if txn['txn_type'] == TokenTxnType.TOKEN_USAGE.value:
-                usage_txns.append(txn)
-            elif txn['txn_type'] == TokenTxnType.TOKEN_PURCHASE.value:
-                purchase_txns.append(txn)
-
-        # Calculate metrics in single pass through filtered lists
-        token_usage_count = abs(sum(txn['amount'] for txn in usage_txns))
-        token_purchase_count = sum(txn['amount'] for txn in purchase_txns)
-        last_token_usage = max((txn['timestamp'] for txn in usage_txns), default=None)
-        last_token_purchase = max((txn['timestamp'] for txn in purchase_txns), default=None)
+        token_transactions = [txn for page in iter_user_token_transaction_pages(user_id) for txn in page]
 
-        return {
-            "token_usage_count": token_usage_count,
-            "token_purchase_count": token_purchase_count,
-            "token_purchase_history": purchase_txns,
-            "last_token_usage": format_date(last_token_usage), 
-            "last_token_purchase": format_date(last_token_purchase),
-        }, None
+        return summarize_token_transactions(token_transactions), None
 
     except Exception as e:
         return None, f"Error retrieving token transactions: {str(e)}"
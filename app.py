@@ -1,6 +1,4 @@
 from flask import Flask, jsonify
-from config import initialize_firebase
-from firebase_admin import firestore
 
 from firestore.routes import firestore_bp
 from agents import agents_bp
@@ -8,13 +6,9 @@ from enterprise.financial_agent import stock_bp
 from replicate_agents import veo_bp
 from analytics import analytics_user_bp
 
-# Initialize Firebase and store the app instance
-firebase_app = initialize_firebase()
+# The Firestore client is created per process on first use, see firestore/db.py
 app = Flask(__name__)
 
-# Get Firestore client from the specific app instance
-db = firestore.client(firebase_app)
-
 app.register_blueprint(firestore_bp, url_prefix='/firestore')
 app.register_blueprint(agents_bp, url_prefix='/agents')
 app.register_blueprint(stock_bp, url_prefix='/stock')
@@ -0,0 +1,204 @@
+import concurrent.futures
+import datetime
+import ipaddress
+import os
+import socket
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+
+import requests
+
+from enterprise.financial_agent.tools.redis.redis_cache import RedisCache
+
+JOB_EXPIRY = 60 * 60 * 24
+# An in-flight ticker stops deduplicating onto its job after this long, in
+# case the process running it died before clearing the marker.
+JOB_DEDUP_TIMEOUT = 60 * 10
+WEBHOOK_ATTEMPTS = 3
+WEBHOOK_TIMEOUT = 10
+# Comma separated hosts webhooks may be sent to; when unset any public host is allowed
+WEBHOOK_ALLOWED_HOSTS = {
+    host.strip().lower() for host in os.getenv("STOCK_REPORT_WEBHOOK_HOSTS", "").split(",") if host.strip()
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class JobStatus:
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+FINISHED_STATUSES = (JobStatus.COMPLETED, JobStatus.FAILED)
+
+
+class InvalidWebhookUrl(ValueError):
+    pass
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def _job_key(job_id):
+    return f"stock_report_job:{job_id}"
+
+
+def _webhooks_key(job_id):
+    return f"stock_report_job:{job_id}:webhooks"
+
+
+def _ticker_key(ticker):
+    return f"stock_report_job_ticker:{ticker}"
+
+
+def _get_executor():
+    """
+    Creates the worker pool on first use, so it is never inherited across a fork.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=int(os.getenv("STOCK_REPORT_JOB_WORKERS", 4)),
+                thread_name_prefix="stock-report-job",
+            )
+        return _executor
+
+
+def validate_webhook_url(webhook_url: str):
+    """
+    Rejects webhook URLs the server should not post to: anything but https,
+    hosts outside STOCK_REPORT_WEBHOOK_HOSTS when it is set, and hosts that
+    resolve to private, loopback, link-local or otherwise internal addresses.
+    """
+    parsed = urlparse(webhook_url)
+    host = (parsed.hostname or "").lower()
+    if parsed.scheme != "https" or not host:
+        raise InvalidWebhookUrl("webhook_url must be an https URL")
+    if WEBHOOK_ALLOWED_HOSTS and host not in WEBHOOK_ALLOWED_HOSTS:
+        raise InvalidWebhookUrl(f"webhook host {host} is not allowed")
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, parsed.port or 443, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError):
+        raise InvalidWebhookUrl(f"webhook host {host} does not resolve")
+    for address in addresses:
+        if not ipaddress.ip_address(address.split("%", 1)[0]).is_global:
+            raise InvalidWebhookUrl(f"webhook host {host} resolves to an internal address")
+
+
+def get_job(job_id: str):
+    return RedisCache().get_cache(_job_key(job_id))
+
+
+def _update_job(cache, job, **fields):
+    job.update(fields, updated_at=_now())
+    cache.set_cache(_job_key(job["job_id"]), job, expiry_time=JOB_EXPIRY)
+    return job
+
+
+def submit_report_job(ticker: str, force_refresh: bool = False, webhook_url: str = None):
+    """
+    Queues a stock report build and returns right away. A request for a ticker
+    that already has a job in flight attaches to that job instead, unless it
+    asks for a refresh the in-flight job is not doing; that starts a new job,
+    which later requests then attach to.
+
+    Returns:
+        tuple: (job, created) where created is False for a deduplicated request.
+    """
+    cache = RedisCache()
+    job_id = str(uuid.uuid4())
+
+    created = cache.set_if_absent(_ticker_key(ticker), job_id, expiry_time=JOB_DEDUP_TIMEOUT)
+    job = None
+    if not created:
+        job = get_job(cache.get_cache(_ticker_key(ticker)) or "")
+        if job is None or (force_refresh and not job.get("force_refresh")):
+            # The in-flight job vanished between the two reads, or would serve a
+            # cached report to a caller asking for a fresh one; take over the marker
+            cache.set_cache(_ticker_key(ticker), job_id, expiry_time=JOB_DEDUP_TIMEOUT)
+            created = True
+
+    if created:
+        job = {
+            "job_id": job_id,
+            "ticker": ticker,
+            "status": JobStatus.QUEUED,
+            "force_refresh": force_refresh,
+            "created_at": _now(),
+            "updated_at": _now(),
+            "result": None,
+            "error": None,
+        }
+        cache.set_cache(_job_key(job_id), job, expiry_time=JOB_EXPIRY)
+
+    if webhook_url:
+        cache.push_to_list(_webhooks_key(job["job_id"]), webhook_url, expiry_time=JOB_EXPIRY)
+        if not created:
+            # The job may have finished, and sent its webhooks, before this one was added
+            latest = get_job(job["job_id"])
+            if latest is not None and latest["status"] in FINISHED_STATUSES:
+                _get_executor().submit(_notify_webhooks, cache, latest)
+
+    if created:
+        _get_executor().submit(_run_job, job, force_refresh)
+    return job, created
+
+
+def _run_job(job, force_refresh):
+    from enterprise.financial_agent.report_builder import CompanyProfileNotFound
+    from enterprise.financial_agent.single_flight import build_stock_report_once
+
+    cache = RedisCache()
+    _update_job(cache, job, status=JobStatus.RUNNING)
+    try:
+        report, errors, freshness = build_stock_report_once(job["ticker"], force_refresh=force_refresh)
+        result = {"success": True, "data": report, "freshness": freshness}
+        if errors:
+            result["errors"] = errors
+        _update_job(cache, job, status=JobStatus.COMPLETED, result=result)
+    except CompanyProfileNotFound:
+        _update_job(cache, job, status=JobStatus.FAILED, error="company_profile_not_found")
+    except Exception as e:
+        print(f"Error building stock report for job {job['job_id']}: {e}")
+        _update_job(cache, job, status=JobStatus.FAILED, error=str(e))
+    finally:
+        # Only clear the dedup marker if it still points at this job
+        if cache.get_cache(_ticker_key(job["ticker"])) == job["job_id"]:
+            cache.delete_cache(_ticker_key(job["ticker"]))
+
+    _notify_webhooks(cache, job)
+
+
+def _notify_webhooks(cache, job):
+    """
+    Sends the finished job to its webhooks. The list is taken atomically, so a
+    webhook added while the job finished is sent by exactly one caller.
+    """
+    for webhook_url in cache.pop_list(_webhooks_key(job["job_id"])):
+        _notify_webhook(webhook_url, job)
+
+
+def _notify_webhook(webhook_url, job):
+    try:
+        # Resolved again here, in case the host's DNS changed since the job was submitted
+        validate_webhook_url(webhook_url)
+    except InvalidWebhookUrl as e:
+        print(f"Webhook {webhook_url} for job {job['job_id']} skipped: {e}")
+        return
+    for attempt in range(WEBHOOK_ATTEMPTS):
+        try:
+            response = requests.post(webhook_url, json=job, timeout=WEBHOOK_TIMEOUT, allow_redirects=False)
+            if response.status_code < 500:
+                return
+            print(f"Webhook {webhook_url} for job {job['job_id']} returned {response.status_code}")
+        except requests.RequestException as e:
+            print(f"Webhook {webhook_url} for job {job['job_id']} failed: {e}")
+        if attempt < WEBHOOK_ATTEMPTS - 1:
+            time.sleep(2 ** attempt)
@@ -0,0 +1,202 @@
+"""
+Builds stock reports ahead of demand for a watchlist of tickers.
+
+Warming a ticker runs the regular report build, which fills every cache layer
+the report uses: the FMP statement bundle, the per-section report cache (the
+scraped and GPT-classified sections) and the AI slides.
+
+Usage:
+    python -m enterprise.financial_agent.prewarm --watchlist watchlist.json
+    python -m enterprise.financial_agent.prewarm --firestore-collection stock_watchlist --window 01:00-05:00 --loop
+"""
+import argparse
+import concurrent.futures
+import datetime
+import json
+import time
+
+from dotenv import load_dotenv
+
+from enterprise.financial_agent.tools import rate_budget
+from firestore.db import get_db
+
+load_dotenv()
+
+DEFAULT_WATCHLIST_COLLECTION = "stock_watchlist"
+DEFAULT_CONCURRENCY = 4
+
+# Per-minute request budgets used while prewarming, leaving headroom for live traffic
+DEFAULT_RATE_BUDGETS = {
+    "fmp": 200,
+    "firecrawl": 60,
+    "openai": 200,
+}
+
+
+def load_watchlist_file(path: str, limit: int = None):
+    """
+    Reads tickers from a JSON file (a list of tickers or of {"ticker": ...} objects)
+    or from a plain text file with one ticker per line.
+    """
+    with open(path) as f:
+        content = f.read()
+    try:
+        entries = json.loads(content)
+    except json.JSONDecodeError:
+        entries = [line.strip() for line in content.splitlines() if line.strip() and not line.startswith("#")]
+
+    tickers = []
+    for entry in entries:
+        ticker = entry.get("ticker") if isinstance(entry, dict) else entry
+        if ticker and ticker.upper() not in tickers:
+            tickers.append(ticker.upper())
+    return tickers[:limit] if limit else tickers
+
+
+def load_watchlist_firestore(collection: str = DEFAULT_WATCHLIST_COLLECTION, limit: int = None):
+    """
+    Reads tickers from a Firestore collection. Each document holds a `ticker`
+    field, or is keyed by the ticker itself.
+    """
+    db = get_db()
+    query = db.collection(collection)
+    if limit:
+        query = query.limit(limit)
+
+    tickers = []
+    for doc in query.stream():
+        ticker = (doc.to_dict() or {}).get("ticker") or doc.id
+        if ticker.upper() not in tickers:
+            tickers.append(ticker.upper())
+    return tickers
+
+
+def parse_window(window: str):
+    """
+    Parses an "HH:MM-HH:MM" UTC window. The window may wrap past midnight.
+    """
+    start, end = window.split("-")
+    return (
+        datetime.datetime.strptime(start.strip(), "%H:%M").time(),
+        datetime.datetime.strptime(end.strip(), "%H:%M").time(),
+    )
+
+
+def in_window(window, now: datetime.datetime = None):
+    if window is None:
+        return True
+    now = (now or datetime.datetime.now(datetime.timezone.utc)).time()
+    start, end = window
+    if start <= end:
+        return start <= now < end
+    return now >= start or now < end
+
+
+def seconds_until_window(window, now: datetime.datetime = None):
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    if in_window(window, now):
+        return 0
+    start = now.replace(hour=window[0].hour, minute=window[0].minute, second=0, microsecond=0)
+    if start <= now:
+        start += datetime.timedelta(days=1)
+    return (start - now).total_seconds()
+
+
+def warm_ticker(ticker: str):
+    """
+    Builds the report for one ticker through the regular cached path.
+
+    Returns:
+        tuple: (number of sections refreshed, error message or None)
+    """
+    from enterprise.financial_agent.single_flight import build_stock_report_once
+    try:
+        _, errors, freshness = build_stock_report_once(ticker)
+        refreshed = sum(1 for section in freshness.values() if not section.get("cached"))
+        return refreshed, (f"section errors: {sorted(errors)}" if errors else None)
+    except Exception as e:
+        return 0, str(e)
+
+
+def warm_watchlist(tickers, concurrency: int = DEFAULT_CONCURRENCY, window=None):
+    """
+    Warms the tickers with at most `concurrency` builds in flight. No new build
+    is started once the off-peak window closes.
+
+    Returns:
+        dict: {"warmed": int, "failed": {ticker: error}, "skipped": int}
+    """
+    summary = {"warmed": 0, "failed": {}, "skipped": 0}
+    remaining = iter(tickers)
+    in_flight = {}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            while len(in_flight) < concurrency and in_window(window):
+                ticker = next(remaining, None)
+                if ticker is None:
+                    break
+                in_flight[executor.submit(warm_ticker, ticker)] = ticker
+
+            if not in_flight:
+                break
+
+            done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                ticker = in_flight.pop(future)
+                refreshed, error = future.result()
+                if error:
+                    summary["failed"][ticker] = error
+                    print(f"Prewarm {ticker} failed: {error}")
+                else:
+                    summary["warmed"] += 1
+                    print(f"Prewarmed {ticker} ({refreshed} sections refreshed)")
+
+    summary["skipped"] = sum(1 for _ in remaining)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prewarm stock report caches for a watchlist.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--watchlist", help="Path to a JSON or text file with tickers.")
+    source.add_argument("--firestore-collection", nargs="?", const=DEFAULT_WATCHLIST_COLLECTION,
+                        help=f"Firestore collection with watchlist documents (default {DEFAULT_WATCHLIST_COLLECTION}).")
+    parser.add_argument("--limit", type=int, default=None, help="Only warm the first N tickers.")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Reports built in parallel.")
+    parser.add_argument("--window", default=None, help="Off-peak UTC window, e.g. 01:00-05:00.")
+    parser.add_argument("--loop", action="store_true", help="Keep running, warming once per window.")
+    parser.add_argument("--interval", type=int, default=3600, help="Seconds between passes in --loop mode without a window.")
+    for provider, rate in DEFAULT_RATE_BUDGETS.items():
+        parser.add_argument(f"--{provider}-rpm", type=int, default=rate, help=f"{provider} requests per minute.")
+    args = parser.parse_args(argv)
+
+    for provider in DEFAULT_RATE_BUDGETS:
+        rate_budget.configure_rate_budget(provider, getattr(args, f"{provider}_rpm"))
+    window = parse_window(args.window) if args.window else None
+
+    while True:
+        wait = seconds_until_window(window) if window else 0
+        if wait:
+            print(f"Waiting {int(wait)}s for the prewarm window")
+            time.sleep(wait)
+
+        if args.watchlist:
+            tickers = load_watchlist_file(args.watchlist, args.limit)
+        else:
+            tickers = load_watchlist_firestore(args.firestore_collection, args.limit)
+        print(f"Prewarming {len(tickers)} tickers")
+        summary = warm_watchlist(tickers, concurrency=args.concurrency, window=window)
+        print(f"Prewarm finished: {summary['warmed']} warmed, {len(summary['failed'])} failed, {summary['skipped']} skipped")
+
+        if not args.loop:
+            return summary
+        if not window:
+            time.sleep(args.interval)
+        # Sleep past the end of the current window before waiting for the next one
+        while window and in_window(window):
+            time.sleep(60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+import concurrent.futures
+import datetime
+import hashlib
+import json
+import time
+
+from enterprise.financial_agent.tools.helper_fns.allFns import (
+    get_fmp_detail, get_company_overview, market_indicies_data, analyst_stock_forecast,
+    fear_and_greed, cot_report, put_call_ratios, analyze_stock_sentiment, piotroski_score,
+    pe_ratios, debt_equity_ratio
+)
+from enterprise.financial_agent.tools.helper_fns.fair_value import determine_fair_value
+from enterprise.financial_agent.tools.helper_fns.buffet import compute_financial_health
+from enterprise.financial_agent.tools.helper_fns.new_fns import (
+    competitor_analysis, product_wise_revenue_breakdown, ai_risk_analysis, ai_overview_json
+)
+from enterprise.financial_agent.tools.redis.report_cache import ReportCache
+from enterprise.financial_agent.tools import tracing
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+# Freshness window per report section: (max age in seconds, tied to the latest filing).
+# A section tied to the filing is recomputed as soon as a newer statement shows up in
+# the FMP bundle; a section with a max age is recomputed once it is older than that.
+SECTION_FRESHNESS = {
+    "fmp_data": (15 * MINUTE, False),
+    "market_indices": (15 * MINUTE, False),
+    "put_call_ratio": (15 * MINUTE, False),
+    "fear_and_greed": (HOUR, False),
+    "social_sentiment": (HOUR, False),
+    "cot_report": (DAY, False),
+    "analyst_forecast": (DAY, False),
+    "competitor_data": (DAY, False),
+    "pe_ratios_val": (DAY, False),
+    "fair_value": (DAY, True),
+    "revenue_segmentation": (None, True),
+    "piotroski_score": (None, True),
+    "buffet": (None, True),
+    "debt_equity_ratio_val": (None, True),
+}
+
+
+class CompanyProfileNotFound(Exception):
+    """Raised when FMP has no company profile for the requested ticker."""
+
+
+def _iso(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat()
+
+
+def _fingerprint(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _filing_fingerprint(fmp_data):
+    income_statement = fmp_data.get("income_statement") or {}
+    balance_sheet = fmp_data.get("balance_sheet") or {}
+    return f"{income_statement.get('date')}|{balance_sheet.get('date')}"
+
+
+def _trim_fmp_data(fmp_data):
+    """
+    Keeps only the latest price point; the report never reads the rest of the
+    (multi-year) price history and it would bloat every cached entry.
+    """
+    price_data = fmp_data.get("price_data")
+    if isinstance(price_data, dict) and isinstance(price_data.get("historical"), list):
+        price_data = {**price_data, "historical": price_data["historical"][:1]}
+    return {**fmp_data, "price_data": price_data}
+
+
+def _is_stale(name, section, filing):
+    max_age, per_filing = SECTION_FRESHNESS[name]
+    age = ReportCache.section_age(section)
+    if age is None:
+        return True
+    if max_age is not None and age > max_age:
+        return True
+    if per_filing and section.get("filing") != filing:
+        return True
+    return False
+
+
+def build_stock_report(ticker: str, force_refresh: bool = False):
+    """
+    Builds the stock report for a ticker, recomputing only the sections whose
+    freshness window has expired and serving the rest from the report cache.
+    The AI slides are only regenerated when the report they summarise changed.
+
+    Parameters:
+        ticker (str): Upper-cased stock ticker symbol.
+        force_refresh (bool): Ignore the cache and rebuild every section.
+
+    Returns:
+        tuple: (report, errors, freshness) where freshness maps each section to
+               its source timestamp and whether it was served from cache.
+
+    Raises:
+        CompanyProfileNotFound: If FMP has no company profile for the ticker.
+    """
+    with tracing.trace("stock_report"):
+        return _build_stock_report(ticker, force_refresh)
+
+
+def _build_stock_report(ticker, force_refresh):
+    report_cache = ReportCache()
+    entry = {"sections": {}, "ai": {}} if force_refresh else report_cache.load(ticker)
+    cached_sections = entry["sections"]
+
+    sections = {}
+    errors = {}
+    freshness = {}
+    pending = {}
+    built_at = time.time()
+    filing = None
+
+    def reuse(name):
+        section = cached_sections.get(name)
+        if section is None or _is_stale(name, section, filing):
+            tracing.record_cache(name, False)
+            return False
+        tracing.record_cache(name, True)
+        sections[name] = section
+        freshness[name] = {"fetched_at": _iso(section["fetched_at"]), "cached": True}
+        return True
+
+    def submit(executor, name, fn, *args):
+        if not reuse(name):
+            pending[name] = executor.submit(tracing.wrap(name, fn), *args)
+
+    def decided(name):
+        return name in sections or name in pending
+
+    def collect(name, future):
+        try:
+            value = future.result()
+        except Exception as e:
+            errors[name] = str(e)
+            stale = cached_sections.get(name)
+            if stale is not None:
+                # Serve the last good value instead of nothing; it stays stale and is retried next time
+                sections[name] = stale
+                freshness[name] = {"fetched_at": _iso(stale["fetched_at"]), "cached": True, "stale": True}
+            return
+        sections[name] = {"value": value, "fetched_at": built_at, "filing": filing}
+        freshness[name] = {"fetched_at": _iso(built_at), "cached": False}
+
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        cached_fmp = sections["fmp_data"]["value"] if reuse("fmp_data") else None
+        fmp_future = None if cached_fmp else executor.submit(tracing.wrap("fmp_data", get_fmp_detail), ticker)
+        if cached_fmp:
+            filing = _filing_fingerprint(cached_fmp)
+
+        submit(executor, "market_indices", market_indicies_data)
+        submit(executor, "analyst_forecast", analyst_stock_forecast, ticker)
+        submit(executor, "fear_and_greed", fear_and_greed)
+        submit(executor, "cot_report", cot_report)
+        submit(executor, "put_call_ratio", put_call_ratios, ticker)
+        submit(executor, "social_sentiment", analyze_stock_sentiment, ticker)
+        submit(executor, "competitor_data", competitor_analysis, ticker, cached_fmp)
+
+        # Filing-bound sections can only be judged once the filing is known,
+        # unless there is nothing cached for them in the first place.
+        if cached_fmp or "revenue_segmentation" not in cached_sections:
+            submit(executor, "revenue_segmentation", product_wise_revenue_breakdown, ticker, cached_fmp)
+        if cached_fmp or "piotroski_score" not in cached_sections:
+            submit(executor, "piotroski_score", piotroski_score, ticker)
+
+        # Wait for fmp_data to finish (needed for dependent calls)
+        if fmp_future is not None:
+            fmp_data = fmp_future.result()
+            if not fmp_data or not fmp_data.get("company_profile"):
+                raise CompanyProfileNotFound(ticker)
+            fmp_data = _trim_fmp_data(fmp_data)
+            filing = _filing_fingerprint(fmp_data)
+            sections["fmp_data"] = {"value": fmp_data, "fetched_at": built_at, "filing": filing}
+            freshness["fmp_data"] = {"fetched_at": _iso(built_at), "cached": False}
+        else:
+            fmp_data = cached_fmp
+
+        company_profile = fmp_data.get("company_profile")
+        price_data = fmp_data.get("price_data", {})
+        financial_metrics = fmp_data.get("financial_metrics", {})
+        income_statement = fmp_data.get("income_statement", {})
+        balance_sheet = fmp_data.get("balance_sheet", {})
+        cash_flow = fmp_data.get("cash_flow", {})
+
+        if not decided("revenue_segmentation"):
+            submit(executor, "revenue_segmentation", product_wise_revenue_breakdown, ticker, fmp_data)
+        if not decided("piotroski_score"):
+            submit(executor, "piotroski_score", piotroski_score, ticker)
+
+        # Now dependent calls
+        submit(executor, "fair_value", determine_fair_value, company_profile[0], income_statement, balance_sheet, financial_metrics)
+        submit(
+            executor, "buffet", compute_financial_health,
+            {"income_statement": income_statement, "balance_sheet": balance_sheet, "cash_flow_statement": cash_flow}
+        )
+        sector = company_profile[0].get("sector", None)
+        submit(executor, "pe_ratios_val", pe_ratios, ticker, sector)
+        submit(executor, "debt_equity_ratio_val", debt_equity_ratio, financial_metrics, company_profile[0])
+
+        for name, future in pending.items():
+            collect(name, future)
+
+    results = {name: section.get("value") for name, section in sections.items()}
+    analyst_forecast = results.get("analyst_forecast") or {}
+    analyst_ratings = analyst_forecast.get("analyst_ratings")
+    forecast = {
+        key: value
+        for key, value in analyst_forecast.items()
+        if key != "analyst_ratings"
+    }
+
+    report = {
+        "slide_1": {
+            "company_overview": get_company_overview(company_profile[0]),
+            "market_indices": results.get("market_indices"),
+            "analyst_ratings": analyst_ratings,
+            "price_data": price_data.get("historical", [{}])[0] if price_data else None,
+            "competitors": results.get("competitor_data"),
+            "revenue_segmentation": results.get("revenue_segmentation")
+        },
+        "slide_2": {
+            "fair_value": results.get("fair_value"),
+            "forecast": forecast
+        },
+        "slide_3": {
+            "sentiment_analysis": {
+                "fear_and_greed_index": results.get("fear_and_greed"),
+                "commitments_of_traders_cot_report": results.get("cot_report"),
+                "put_call_ratio": results.get("put_call_ratio"),
+                "news_sentiment": results.get("social_sentiment")
+            }
+        },
+        "slide_4": {
+            "investment_frameworks": {
+                "piotroski_score": results.get("piotroski_score"),
+                "buffet_table": results.get("buffet")
+            }
+        },
+        "slide_5": {
+            "pe_ratios": results.get("pe_ratios_val"),
+            "debt_equity_ratio": results.get("debt_equity_ratio_val")
+        }
+    }
+
+    # The AI slides summarise slides 1-5, so they are only regenerated when those changed
+    ai_fingerprint = _fingerprint(report)
+    cached_ai = entry["ai"]
+    ai_entry = cached_ai
+    tracing.record_cache("ai", cached_ai.get("fingerprint") == ai_fingerprint)
+    if cached_ai.get("fingerprint") == ai_fingerprint:
+        ai_risks = cached_ai.get("ai_risks")
+        ai_overview = cached_ai.get("ai_overview")
+        freshness["ai"] = {"fetched_at": _iso(cached_ai["fetched_at"]), "cached": True}
+    else:
+        # Run AI analysis in parallel with max_workers=2
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as ai_executor:
+            ai_risks_future = ai_executor.submit(tracing.wrap("ai_risks", ai_risk_analysis), report)
+            ai_overview_future = ai_executor.submit(tracing.wrap("ai_overview", ai_overview_json), report)
+            ai_risks = ai_risks_future.result()
+            ai_overview = ai_overview_future.result()
+        freshness["ai"] = {"fetched_at": _iso(built_at), "cached": False}
+        # Both helpers swallow their errors and return {}, which must not be cached
+        if ai_risks and ai_overview:
+            ai_entry = {
+                "fingerprint": ai_fingerprint,
+                "fetched_at": built_at,
+                "ai_risks": ai_risks,
+                "ai_overview": ai_overview,
+            }
+    report["slide_6"] = {"ai_risks": ai_risks}
+    report["slide_1"]["ai_overview"] = ai_overview
+
+    if pending or fmp_future is not None or ai_entry is not cached_ai:
+        report_cache.save(ticker, {"sections": sections, "ai": ai_entry})
+
+    return report, errors, freshness
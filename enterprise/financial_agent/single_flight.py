@@ -0,0 +1,72 @@
+import concurrent.futures
+import threading
+
+from redis.exceptions import LockError
+
+from enterprise.financial_agent.report_builder import build_stock_report
+from enterprise.financial_agent.tools.redis.redis_cache import RedisCache
+from enterprise.financial_agent.tools import tracing
+
+# A report build takes 30-90s; the lock expires on its own if its holder dies.
+LOCK_TIMEOUT = 180
+# How long another process waits for the holder before building anyway.
+LOCK_WAIT = 150
+
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def build_stock_report_once(ticker: str, force_refresh: bool = False):
+    """
+    Same contract as build_stock_report, but concurrent requests for one ticker
+    share a single build: callers in this process attach to the in-flight build
+    and receive its result, and other processes wait on a Redis lock and then
+    read the sections the holder just cached.
+    """
+    with _in_flight_lock:
+        future = _in_flight.get(ticker)
+        leader = future is None
+        if leader:
+            future = concurrent.futures.Future()
+            _in_flight[ticker] = future
+
+    if not leader:
+        with tracing.section("coalesced_wait"):
+            return future.result()
+
+    try:
+        result = _build_with_redis_lock(ticker, force_refresh)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _in_flight_lock:
+            _in_flight.pop(ticker, None)
+
+
+def _build_with_redis_lock(ticker, force_refresh):
+    try:
+        lock = RedisCache().redis_client.lock(f"stock_report_lock:{ticker}", timeout=LOCK_TIMEOUT)
+        acquired = lock.acquire(blocking=False)
+    except Exception as e:
+        print(f"Error acquiring stock report lock for {ticker}, building without it: {e}")
+        return build_stock_report(ticker, force_refresh=force_refresh)
+
+    if not acquired:
+        # Another process is building this ticker; once it is done its sections
+        # are fresh in the report cache and our build is served from there.
+        with tracing.section("lock_wait"):
+            acquired = lock.acquire(blocking=True, blocking_timeout=LOCK_WAIT)
+        force_refresh = False
+
+    try:
+        return build_stock_report(ticker, force_refresh=force_refresh)
+    finally:
+        if acquired:
+            try:
+                lock.release()
+            except LockError:
+                # The lock expired while we were still building
+                pass
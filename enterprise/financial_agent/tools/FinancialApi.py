@@ -1,6 +1,11 @@
 import requests
 import json
 import os
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from enterprise.financial_agent.tools import rate_budget, tracing
 
 class FinancialModelingPrepAPI:
     """
@@ -8,6 +13,9 @@ class FinancialModelingPrepAPI:
     """
     BASE_URL = "https://financialmodelingprep.com/api/v3"
     BASE_URL_V4 = "https://financialmodelingprep.com/api/v4"
+    MAX_RATE_LIMIT_RETRIES = 2
+    # Longest wait on a 429, whatever Retry-After asks for
+    MAX_RETRY_AFTER = 30
 
     def __init__(self):
         """Initialize with API key from environment variable or parameter."""
@@ -19,9 +27,37 @@ class FinancialModelingPrepAPI:
         base_url = self.BASE_URL if version == "v3" else self.BASE_URL_V4
         url = f"{base_url}/{endpoint}"
         params["apikey"] = self.api_key
-        response = requests.get(url, params=params)
+        started = time.perf_counter()
+        for attempt in range(self.MAX_RATE_LIMIT_RETRIES + 1):
+            rate_budget.acquire("fmp")
+            response = requests.get(url, params=params)
+            if response.status_code != 429 or attempt == self.MAX_RATE_LIMIT_RETRIES:
+                break
+            # Rate limited: back off for as long as FMP asks before retrying
+            time.sleep(self._retry_after(response.headers.get("Retry-After"), attempt))
+        tracing.record_call(
+            "fmp", endpoint.split("?")[0], started,
+            error=f"HTTP {response.status_code}" if response.status_code >= 400 else None,
+            bytes=len(response.content), retries=attempt
+        )
         return response.json()
 
+    def _retry_after(self, header, attempt):
+        """
+        Seconds to wait from a Retry-After header, which is either a number of
+        seconds or an HTTP date, falling back to exponential backoff. Capped.
+        """
+        delay = 2 ** attempt
+        if header:
+            try:
+                delay = float(header)
+            except ValueError:
+                try:
+                    delay = (parsedate_to_datetime(header) - datetime.now(timezone.utc)).total_seconds()
+                except (TypeError, ValueError):
+                    pass
+        return min(max(delay, 0), self.MAX_RETRY_AFTER)
+
     # ✅ Company Data
     def get_company_profile(self, symbol: str) -> dict:
         return self._make_request(f"profile/{symbol}")
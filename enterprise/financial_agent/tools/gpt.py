@@ -1,9 +1,12 @@
 from enum import Enum
 from typing import Optional, Dict, Any
 import os
+import time
 import openai
 from openai import OpenAI
 
+from enterprise.financial_agent.tools import rate_budget, tracing
+
 class GPTAnalysisEngine:
     def __init__(self, default_model: str = "gpt-4o"):
         self.api_key = os.getenv('OPENAI_API_KEY')
@@ -34,25 +37,32 @@ class GPTAnalysisEngine:
             str: Generated analysis response
         """
         analysis_prompt = self._prepare_prompt(prompt, data)
+        rate_budget.acquire("openai")
+        started = time.perf_counter()
 
+        request_kwargs = {}
         if output_format=="json":
+            request_kwargs["response_format"] = {"type":"json_object"}
+        try:
             response = self.client.chat.completions.create(
             model=model or self.default_model,
             messages=[
                 {"role": "user", "content": analysis_prompt}
             ],
             max_tokens=max_tokens,
-            response_format={"type":"json_object"}
-            )
-        else:
-            response = self.client.chat.completions.create(
-            model=model or self.default_model,
-            messages=[
-                {"role": "user", "content": analysis_prompt}
-            ],
-            max_tokens=max_tokens,
+            **request_kwargs
             )
-    
+        except Exception as e:
+            tracing.record_call("openai", "chat.completions", started, error=str(e), model=model or self.default_model)
+            raise
+
+        usage = response.usage
+        tracing.record_call(
+            "openai", "chat.completions", started,
+            model=response.model,
+            input_tokens=usage.prompt_tokens if usage else 0,
+            output_tokens=usage.completion_tokens if usage else 0
+        )
         return response.choices[0].message.content
     
     def _prepare_prompt(self, prompt: str, data: Optional[Dict[str, Any]] = None) -> str:
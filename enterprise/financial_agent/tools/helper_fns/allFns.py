@@ -8,22 +8,26 @@ from enterprise.financial_agent.tools.gpt import GPTAnalysisEngine
 from pydantic import BaseModel, Field
 from enterprise.financial_agent.tools.scrapers.crawl import CrawlScraper
 from enterprise.financial_agent.tools.redis.redis_cache import RedisCache
+from enterprise.financial_agent.tools import tracing
 
 fmp = FinancialModelingPrepAPI()
 gpt_engine = GPTAnalysisEngine()
 
 def get_fmp_detail(ticker: str):
     import datetime
+    import time
     cache = RedisCache()
     key=ticker+"_API_data"
 
     # Check if data is cached
+    started = time.perf_counter()
     cached_data = cache.get_cache(key)
     use_cache=False
     if cached_data:
         balance_sheet_date = cached_data["balance_sheet"].get("date")
         if balance_sheet_date and (datetime.datetime.now() - datetime.datetime.strptime(balance_sheet_date, "%Y-%m-%d")).days <= 365:
             use_cache=True
+    tracing.record_call("redis", "fmp_statements", started, cache="hit" if use_cache else "miss")
 
     # Fetch data from API
     company_profile = fmp.get_company_profile(ticker)
@@ -0,0 +1,55 @@
+import threading
+import time
+
+# Requests per minute allowed per provider. Empty by default, so the web app
+# is not throttled; background jobs such as the prewarmer configure a budget.
+_budgets = {}
+_lock = threading.Lock()
+
+
+class RateBudget:
+    """
+    Token bucket that allows `rate_per_minute` calls, refilled continuously.
+    """
+
+    def __init__(self, rate_per_minute: int):
+        self.capacity = max(1, rate_per_minute)
+        self.tokens = float(self.capacity)
+        self.refill_per_second = self.capacity / 60.0
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a call may be made.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.refill_per_second
+            time.sleep(wait)
+
+
+def configure_rate_budget(provider: str, rate_per_minute: int = None):
+    """
+    Sets (or with rate_per_minute=None removes) the budget for a provider.
+    """
+    with _lock:
+        if rate_per_minute:
+            _budgets[provider] = RateBudget(rate_per_minute)
+        else:
+            _budgets.pop(provider, None)
+
+
+def acquire(provider: str):
+    """
+    Waits for the provider's budget, if one is configured.
+    """
+    budget = _budgets.get(provider)
+    if budget is not None:
+        budget.acquire()
@@ -37,6 +37,43 @@ class RedisCache:
                 return value  # Return as-is if not JSON
         return None
 
+    def set_if_absent(self, key, value, expiry_time=None):
+        """
+        Stores a value only if the key does not exist yet. Returns True if it was stored.
+        """
+        if isinstance(value, dict) or isinstance(value, list):
+            value = json.dumps(value)
+
+        return bool(self.redis_client.set(key, value, ex=expiry_time, nx=True))
+
+    def push_to_list(self, key, value, expiry_time=None):
+        """
+        Appends a value to the list stored at key.
+        """
+        if isinstance(value, dict) or isinstance(value, list):
+            value = json.dumps(value)
+
+        self.redis_client.rpush(key, value)
+        if expiry_time:
+            self.redis_client.expire(key, expiry_time)
+
+    def pop_list(self, key):
+        """
+        Retrieves every value of the list stored at key and deletes it in one
+        transaction, so concurrent callers never both get the same value.
+        """
+        pipeline = self.redis_client.pipeline()
+        pipeline.lrange(key, 0, -1)
+        pipeline.delete(key)
+        raw_values, _ = pipeline.execute()
+        values = []
+        for value in raw_values:
+            try:
+                values.append(json.loads(value))
+            except json.JSONDecodeError:
+                values.append(value)
+        return values
+
     def delete_cache(self, key):
         """
         Deletes a key from Redis.
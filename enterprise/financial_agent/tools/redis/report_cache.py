@@ -0,0 +1,56 @@
+import time
+
+from enterprise.financial_agent.tools.redis.redis_cache import RedisCache
+
+# How long an assembled report is kept around at all. Individual sections
+# carry their own freshness windows (see report_builder.SECTION_FRESHNESS).
+REPORT_CACHE_EXPIRY = 60 * 60 * 24 * 30
+
+
+class ReportCache:
+    """
+    Stores the assembled stock report per ticker, section by section.
+
+    Layout of a cached entry:
+        {
+            "sections": {<name>: {"value": ..., "fetched_at": <epoch>, "filing": <str|None>}},
+            "ai": {"fingerprint": <str>, "fetched_at": <epoch>, "ai_risks": ..., "ai_overview": ...}
+        }
+    """
+
+    def __init__(self):
+        self.cache = RedisCache()
+
+    @staticmethod
+    def key(ticker):
+        return ticker + "_stock_report"
+
+    def load(self, ticker):
+        """
+        Returns the cached entry for a ticker, or an empty entry if there is none.
+        """
+        entry = None
+        try:
+            entry = self.cache.get_cache(self.key(ticker))
+        except Exception as e:
+            print(f"Error reading report cache for {ticker}: {e}")
+        if not isinstance(entry, dict):
+            entry = {}
+        entry.setdefault("sections", {})
+        entry.setdefault("ai", {})
+        return entry
+
+    def save(self, ticker, entry):
+        try:
+            self.cache.set_cache(self.key(ticker), entry, expiry_time=REPORT_CACHE_EXPIRY)
+        except Exception as e:
+            print(f"Error writing report cache for {ticker}: {e}")
+
+    @staticmethod
+    def section_age(section):
+        """
+        Seconds since the section was fetched, or None if it was never cached.
+        """
+        if not section or "fetched_at" not in section:
+            return None
+        return time.time() - section["fetched_at"]
@@ -1,14 +1,32 @@
+import json
 import os
+import time
 from firecrawl import FirecrawlApp, JsonConfig
 from pydantic import BaseModel
 
 from enterprise.financial_agent.tools.gpt import GPTAnalysisEngine
+from enterprise.financial_agent.tools import rate_budget, tracing
 
 class CrawlScraper:
     def __init__(self, api_key: str = os.getenv("FIRECRAWL_API_KEY"), extra_headers: dict[str, str] = None):
         self.api_key = api_key
         self.extra_headers = extra_headers
         self.app = FirecrawlApp(api_key=self.api_key)
+
+    def _scrape_url(self, url: str, **kwargs):
+        """
+        Calls Firecrawl within the provider's rate budget and records the call on the active trace.
+        """
+        rate_budget.acquire("firecrawl")
+        started = time.perf_counter()
+        try:
+            result = self.app.scrape_url(url, **kwargs)
+        except Exception as e:
+            tracing.record_call("firecrawl", url, started, error=str(e))
+            raise
+        size = len(result.markdown or "") + (len(json.dumps(result.json, default=str)) if result.json else 0)
+        tracing.record_call("firecrawl", url, started, error=result.error or None, bytes=size)
+        return result
     
     def format_json_with_schema(self, json_data: dict, schema: dict, markdown: str|None = None) -> dict:
         """
@@ -50,7 +68,7 @@ class CrawlScraper:
             prompt=instruction
         )
         try:
-            result = self.app.scrape_url(
+            result = self._scrape_url(
                 url,
                 formats=["json", "markdown"],
                 json_options=json_config
@@ -79,7 +97,7 @@ class CrawlScraper:
         Scrape the URL using markdown format, then extract structured data using GPTAnalysisEngine.
         """
         try:
-            result = self.app.scrape_url(
+            result = self._scrape_url(
                 url,
                 formats=["markdown"],
             )
@@ -0,0 +1,250 @@
+"""
+Per-request tracing for the stock report pipeline.
+
+A trace is opened around a report build and is visible to every thread the
+build hands work to (through `wrap`). Sections record wall time, queue wait,
+cache hit/miss and errors; provider clients record their individual calls
+(FMP, Firecrawl, OpenAI) against the section they run in. Finished traces
+are folded into process-wide metrics served by the /stock/metrics endpoint.
+"""
+import collections
+import contextlib
+import contextvars
+import functools
+import threading
+import time
+
+_current_trace = contextvars.ContextVar("stock_report_trace", default=None)
+_current_section = contextvars.ContextVar("stock_report_section", default=None)
+
+# Durations kept per metric for percentiles
+METRICS_WINDOW = 500
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1)
+
+
+class Trace:
+    def __init__(self, name: str):
+        self.name = name
+        self.started_at = time.time()
+        self.duration = None
+        self.sections = {}
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def get_section(self, name: str):
+        with self.lock:
+            return self.sections.setdefault(name, {
+                "wall_ms": None,
+                "queue_wait_ms": None,
+                "cache": None,
+                "error": None,
+                "calls": [],
+            })
+
+    def add_call(self, section_name, call):
+        if section_name is None:
+            with self.lock:
+                self.calls.append(call)
+            return
+        section = self.get_section(section_name)
+        with self.lock:
+            section["calls"].append(call)
+
+    def to_dict(self):
+        with self.lock:
+            sections = {}
+            for name, section in self.sections.items():
+                calls = section["calls"]
+                sections[name] = {
+                    **section,
+                    "bytes": sum(call.get("bytes", 0) for call in calls),
+                    "input_tokens": sum(call.get("input_tokens", 0) for call in calls),
+                    "output_tokens": sum(call.get("output_tokens", 0) for call in calls),
+                    "retries": sum(call.get("retries", 0) for call in calls),
+                }
+            return {
+                "name": self.name,
+                "total_ms": _ms(self.duration) if self.duration is not None else None,
+                "sections": sections,
+                "calls_outside_sections": list(self.calls),
+            }
+
+
+class PipelineMetrics:
+    """
+    Process-wide aggregates of finished traces, per section and per provider.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.traces = 0
+            self.sections = collections.defaultdict(self._empty)
+            self.providers = collections.defaultdict(self._empty)
+
+    @staticmethod
+    def _empty():
+        return {
+            "count": 0,
+            "errors": 0,
+            "cache_hits": 0,
+            "cache_misses": 0,
+            "retries": 0,
+            "bytes": 0,
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "durations": collections.deque(maxlen=METRICS_WINDOW),
+        }
+
+    @staticmethod
+    def _add(bucket, duration_ms, error=None, retries=0, size=0, input_tokens=0, output_tokens=0):
+        bucket["count"] += 1
+        bucket["errors"] += 1 if error else 0
+        bucket["retries"] += retries
+        bucket["bytes"] += size
+        bucket["input_tokens"] += input_tokens
+        bucket["output_tokens"] += output_tokens
+        if duration_ms is not None:
+            bucket["durations"].append(duration_ms)
+
+    def record_trace(self, trace: Trace):
+        data = trace.to_dict()
+        with self.lock:
+            self.traces += 1
+            for name, section in data["sections"].items():
+                bucket = self.sections[name]
+                if section["cache"] == "hit":
+                    bucket["cache_hits"] += 1
+                elif section["cache"] == "miss":
+                    bucket["cache_misses"] += 1
+                if section["wall_ms"] is not None or section["error"]:
+                    self._add(bucket, section["wall_ms"], section["error"], section["retries"],
+                              section["bytes"], section["input_tokens"], section["output_tokens"])
+                for call in section["calls"]:
+                    self._add_call(call)
+            for call in data["calls_outside_sections"]:
+                self._add_call(call)
+
+    def _add_call(self, call):
+        self._add(self.providers[call["provider"]], call["duration_ms"], call.get("error"), call.get("retries", 0),
+                  call.get("bytes", 0), call.get("input_tokens", 0), call.get("output_tokens", 0))
+
+    @staticmethod
+    def _summarise(bucket):
+        durations = sorted(bucket["durations"])
+        summary = {key: value for key, value in bucket.items() if key != "durations"}
+        if durations:
+            summary["p50_ms"] = durations[len(durations) // 2]
+            summary["p95_ms"] = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+            summary["max_ms"] = durations[-1]
+        return summary
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "traces": self.traces,
+                "sections": {name: self._summarise(bucket) for name, bucket in self.sections.items()},
+                "providers": {name: self._summarise(bucket) for name, bucket in self.providers.items()},
+            }
+
+
+METRICS = PipelineMetrics()
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextlib.contextmanager
+def trace(name: str):
+    """
+    Opens a trace, or joins the one already open in this context.
+    """
+    existing = _current_trace.get()
+    if existing is not None:
+        yield existing
+        return
+
+    new_trace = Trace(name)
+    token = _current_trace.set(new_trace)
+    started = time.perf_counter()
+    try:
+        yield new_trace
+    finally:
+        new_trace.duration = time.perf_counter() - started
+        _current_trace.reset(token)
+        METRICS.record_trace(new_trace)
+
+
+@contextlib.contextmanager
+def section(name: str, queued_at: float = None):
+    """
+    Times a pipeline section; provider calls made inside it are attributed to it.
+    """
+    active = _current_trace.get()
+    if active is None:
+        yield
+        return
+
+    record = active.get_section(name)
+    started = time.perf_counter()
+    if queued_at is not None:
+        record["queue_wait_ms"] = _ms(started - queued_at)
+    token = _current_section.set(name)
+    try:
+        yield
+    except Exception as e:
+        record["error"] = str(e)
+        raise
+    finally:
+        record["wall_ms"] = _ms(time.perf_counter() - started)
+        _current_section.reset(token)
+
+
+def wrap(name: str, fn):
+    """
+    Binds fn to the current trace as section `name`, for submitting to an executor.
+    Queue wait is measured from this call until a worker picks the task up.
+    """
+    context = contextvars.copy_context()
+    queued_at = time.perf_counter()
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        def in_section():
+            with section(name, queued_at=queued_at):
+                return fn(*args, **kwargs)
+        return context.run(in_section)
+
+    return run
+
+
+def record_cache(name: str, hit: bool):
+    active = _current_trace.get()
+    if active is not None:
+        active.get_section(name)["cache"] = "hit" if hit else "miss"
+
+
+def record_call(provider: str, operation: str, started: float, error: str = None, **fields):
+    """
+    Records one provider call made since `started` (a time.perf_counter() value).
+    Extra fields: bytes, input_tokens, output_tokens, retries, model, cache.
+    """
+    active = _current_trace.get()
+    if active is None:
+        return
+    call = {
+        "provider": provider,
+        "operation": operation,
+        "duration_ms": _ms(time.perf_counter() - started),
+        **fields,
+    }
+    if error:
+        call["error"] = error
+    active.add_call(_current_section.get(), call)
@@ -0,0 +1,111 @@
+import asyncio
+import os
+import threading
+
+from .db import get_async_db
+
+# Coroutines a single fan-out runs at once
+ASYNC_CONCURRENCY = int(os.getenv("FIRESTORE_ASYNC_CONCURRENCY", 100))
+# Documents asked for per BatchGetDocuments call
+GET_ALL_CHUNK_SIZE = 300
+# Partitions a collection group scan is split into
+SCAN_PARTITIONS = int(os.getenv("FIRESTORE_SCAN_PARTITIONS", 16))
+
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop():
+    """
+    One event loop per process, on a daemon thread, so the AsyncClient and its
+    channel opened on it are reused by every request.
+    """
+    global _loop, _loop_pid
+    with _loop_lock:
+        if _loop is None or _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            threading.Thread(target=_loop.run_forever, name="firestore-async", daemon=True).start()
+        return _loop
+
+
+def spawn(coroutine):
+    """Starts a coroutine on the process's loop from sync code and returns its concurrent Future."""
+    return asyncio.run_coroutine_threadsafe(coroutine, _get_loop())
+
+
+def run(coroutine):
+    """Runs a coroutine to completion from sync code, such as a Flask view."""
+    return spawn(coroutine).result()
+
+
+async def gather_limited(coroutines, limit: int = ASYNC_CONCURRENCY, return_exceptions: bool = False):
+    """
+    asyncio.gather with at most limit of the coroutines running at once.
+    Results come back in the order the coroutines were given.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def limited(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*(limited(c) for c in coroutines), return_exceptions=return_exceptions)
+
+
+async def get_documents(paths, field_paths=None):
+    """
+    Reads many documents in batched get_all calls. Returns {path: data}, with
+    None for documents that do not exist.
+    """
+    db = get_async_db()
+    paths = list(dict.fromkeys(paths))
+
+    async def get_chunk(chunk):
+        refs = [db.document(path) for path in chunk]
+        return [(snapshot.reference.path, snapshot.to_dict() if snapshot.exists else None)
+                async for snapshot in db.get_all(refs, field_paths=field_paths)]
+
+    chunks = [paths[i:i + GET_ALL_CHUNK_SIZE] for i in range(0, len(paths), GET_ALL_CHUNK_SIZE)]
+    documents = {}
+    for chunk_documents in await gather_limited(get_chunk(chunk) for chunk in chunks):
+        documents.update(chunk_documents)
+    return documents
+
+
+async def get_agent_owners(agent_ids):
+    """
+    agent_id -> user_id for many agents, from the owner index where possible
+    and one batched read of the user_id field for the rest.
+    """
+    from .owner_index import owner_index
+    owners = {agent_id: owner_index.get(agent_id) for agent_id in agent_ids}
+    missing = [f"custom_agents/{agent_id}" for agent_id, owner in owners.items() if owner is None]
+    if missing:
+        for path, data in (await get_documents(missing, field_paths=['user_id'])).items():
+            agent_id = path.rsplit("/", 1)[-1]
+            owners[agent_id] = (data or {}).get('user_id')
+            owner_index.set(agent_id, owners[agent_id])
+    return owners
+
+
+async def scan_collection_group(collection_id, handle, field_paths=None, partition_count=None):
+    """
+    Reads every document of a collection group with one query per partition,
+    run concurrently, and calls handle(snapshot) on each. handle runs on the
+    event loop, so it can update shared state without locking.
+    """
+    db = get_async_db()
+    collection_group = db.collection_group(collection_id)
+    partition_count = partition_count or SCAN_PARTITIONS
+    partitions = [partition async for partition in collection_group.get_partitions(partition_count)]
+
+    async def scan(partition):
+        query = partition.query()
+        if field_paths:
+            query = query.select(field_paths)
+        async for snapshot in query.stream():
+            handle(snapshot)
+
+    await gather_limited(scan(partition) for partition in partitions)
@@ -0,0 +1,66 @@
+import os
+import threading
+import weakref
+
+from google.cloud import firestore
+
+_lock = threading.Lock()
+_pid = None
+_db = None
+_async_dbs = weakref.WeakKeyDictionary()
+
+
+def _client_args():
+    """
+    Project and credentials for a client. With FIRESTORE_EMULATOR_HOST set the
+    local emulator is used and the service account key is never read.
+    """
+    if os.getenv("FIRESTORE_EMULATOR_HOST"):
+        from google.auth.credentials import AnonymousCredentials
+        return {
+            "project": os.getenv("FIRESTORE_PROJECT_ID", "demo-vestra"),
+            "credentials": AnonymousCredentials(),
+        }
+
+    from config import initialize_firebase
+    firebase_app = initialize_firebase()
+    credentials = firebase_app.credential.get_credential()
+    return {
+        "project": firebase_app.project_id or getattr(credentials, "project_id", None),
+        "credentials": credentials,
+    }
+
+
+def _check_pid():
+    # gRPC channels must not cross a fork: a worker forked from a preloaded
+    # master drops the clients it inherited and opens its own on first use
+    global _pid, _db
+    if _pid != os.getpid():
+        _pid = os.getpid()
+        _db = None
+        _async_dbs.clear()
+
+
+def get_db() -> firestore.Client:
+    """The process's Firestore client, created on first use."""
+    global _db
+    with _lock:
+        _check_pid()
+        if _db is None:
+            _db = firestore.Client(**_client_args())
+        return _db
+
+
+def get_async_db() -> firestore.AsyncClient:
+    """
+    The Firestore AsyncClient for the running event loop. Async gRPC channels
+    are bound to the loop they were opened on, so each loop gets its own client.
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    with _lock:
+        _check_pid()
+        client = _async_dbs.get(loop)
+        if client is None:
+            client = _async_dbs[loop] = firestore.AsyncClient(**_client_args())
+        return client
@@ -0,0 +1,66 @@
+import collections
+import os
+import threading
+import time
+
+# Agents whose owner is remembered, least recently used evicted first
+OWNER_INDEX_SIZE = int(os.getenv("OWNER_INDEX_SIZE", 10000))
+# Seconds an entry is trusted; bounds how long another process's delete goes unseen
+OWNER_INDEX_TTL = float(os.getenv("OWNER_INDEX_TTL", 60))
+
+
+class OwnerIndex:
+    """
+    In-process agent_id -> user_id map, so ownership checks skip the agent read.
+    An agent's owner never changes, so an entry only goes stale when the agent
+    is deleted.
+
+    A delete in this process removes the entry and leaves a tombstone, so a
+    check that read the agent just before the delete cannot put it back. A
+    delete in another process is not seen until the entry expires: until then
+    update() still fails on the missing document, but reads of the agent's
+    subcollections (runs and their stats), which outlive the agent document,
+    still pass the check.
+    """
+
+    def __init__(self, max_entries: int = OWNER_INDEX_SIZE, ttl: float = OWNER_INDEX_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.owners = collections.OrderedDict()
+        self.deleted = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, agent_id):
+        with self.lock:
+            entry = self.owners.get(agent_id)
+            if entry is None:
+                return None
+            owner, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.owners[agent_id]
+                return None
+            self.owners.move_to_end(agent_id)
+            return owner
+
+    def set(self, agent_id, user_id):
+        if not user_id:
+            return
+        with self.lock:
+            if agent_id in self.deleted:
+                return
+            self.owners[agent_id] = (user_id, time.monotonic() + self.ttl)
+            self.owners.move_to_end(agent_id)
+            while len(self.owners) > self.max_entries:
+                self.owners.popitem(last=False)
+
+    def invalidate(self, agent_id, deleted: bool = False):
+        """Drops the entry; with deleted, also keeps it from being set again."""
+        with self.lock:
+            self.owners.pop(agent_id, None)
+            if deleted:
+                self.deleted[agent_id] = True
+                while len(self.deleted) > self.max_entries:
+                    self.deleted.popitem(last=False)
+
+
+owner_index = OwnerIndex()
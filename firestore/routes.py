@@ -1,5 +1,5 @@
-from flask import Blueprint, request, jsonify
-from .utils import get_user, create_agent, update_agent_config, delete_agent_config, get_runs_for_agent
+from flask import Blueprint, request, jsonify, make_response
+from .utils import get_user, create_agent, update_agent_config, delete_agent_config, get_runs_for_agent, get_run_for_agent, get_run_stats_for_agent, list_agents, get_agents_etag
 from middleware.auth import jwt_required
 
 firestore_bp = Blueprint('firestore', __name__)
@@ -51,8 +51,62 @@ def delete_agent():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@firestore_bp.route('/agents', methods=['GET'])
+@jwt_required
+def get_agents():
+    user_id = request.user_id
+    after = request.args.get('after')
+    try:
+        page_size = int(request.args.get('page_size', 20))
+        if page_size < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": "page_size must be a positive integer"}), 400
+    try:
+        # Worked out before the page, so a list that changes in between only costs a refetch
+        etag = get_agents_etag(user_id, page_size, after)
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+        else:
+            response = make_response(list_agents(user_id, page_size=page_size, after=after))
+        response.set_etag(etag)
+        return response
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @firestore_bp.route('/<agent_id>/runs', methods=['GET'])
 @jwt_required
 def get_agent_runs(agent_id):
     user_id = request.user_id
-    return get_runs_for_agent(user_id, agent_id)
\ No newline at end of file
+    try:
+        page_size = int(request.args.get('page_size', 20))
+        if page_size < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": "page_size must be a positive integer"}), 400
+    try:
+        return get_runs_for_agent(user_id, agent_id, page_size=page_size, after=request.args.get('after'))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@firestore_bp.route('/<agent_id>/runs/<run_id>', methods=['GET'])
+@jwt_required
+def get_agent_run(agent_id, run_id):
+    try:
+        return get_run_for_agent(request.user_id, agent_id, run_id)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@firestore_bp.route('/<agent_id>/runs/stats', methods=['GET'])
+@jwt_required
+def get_agent_run_stats(agent_id):
+    try:
+        days = int(request.args.get('days', 30))
+        if days < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": "days must be a positive integer"}), 400
+    try:
+        return get_run_stats_for_agent(request.user_id, agent_id, days=days)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
@@ -1,72 +1,303 @@
+import hashlib
+
 from google.cloud import firestore
+from google.api_core.exceptions import NotFound
 from flask import jsonify
-from datetime import datetime, UTC
+from datetime import datetime, timedelta, UTC
+from .db import get_db
 
 def get_user(user_id):
-    from app import db
+    db = get_db()
     user = db.collection('users').document(user_id).get()
     if user.exists:
         return jsonify(user.to_dict()), 200
     return jsonify({"error": "User not found"}), 404
 
-def create_agent(user_id, agent_data):
-    from app import db
+def create_agent(user_id, agent_data, defer_write=False):
+    from .owner_index import owner_index
+    from .write_behind import write_behind
+    db = get_db()
     agent_data['user_id'] = user_id
-    agent_data['created_at'] = datetime.now(UTC).isoformat()
+    agent_data['created_at'] = agent_data['updated_at'] = datetime.now(UTC).isoformat()
+    # Stored so agent listings can show it without reading the member configs
+    agent_data['member_count'] = len(agent_data.get('agents') or [])
+    # document() picks the id client side, so no round trip is needed for it
     agent_ref = db.collection('custom_agents').document()
     agent_data["agent_id"] = agent_ref.id
-    agent_ref.set(agent_data)
+    owner_index.set(agent_ref.id, user_id)
+    if defer_write:
+        write_behind.put(agent_ref.path, dict(agent_data))
+    else:
+        agent_ref.set(agent_data)
     return jsonify({"message": "Agent created successfully", "agent_id": agent_ref.id}), 201
 
+def _check_owner(agent_ref, user_id):
+    """
+    Whether user_id owns the agent, answered from the owner index when possible.
+    On a miss only the agent's user_id field is read.
+    """
+    from .owner_index import owner_index
+    owner = owner_index.get(agent_ref.id)
+    if owner is not None:
+        return owner == user_id
+    agent = agent_ref.get(field_paths=['user_id'])
+    if not agent.exists:
+        return False
+    owner = agent.to_dict().get('user_id')
+    owner_index.set(agent_ref.id, owner)
+    return owner == user_id
+
 def get_agent_config(user_id, agent_id):
-    from app import db
-    agent_ref = db.collection('custom_agents').document(agent_id)
-    agent = agent_ref.get()
-    if agent.exists and agent.to_dict().get('user_id') == user_id:
-        return jsonify(agent.to_dict()), 200
+    from .owner_index import owner_index
+    db = get_db()
+    agent = db.collection('custom_agents').document(agent_id).get()
+    agent_data = agent.to_dict() if agent.exists else None
+    if agent_data is not None:
+        owner_index.set(agent_id, agent_data.get('user_id'))
+        if agent_data.get('user_id') == user_id:
+            return jsonify(agent_data), 200
     return jsonify({"error": "Agent not found or not authorized to use this agent"}), 404
 
 def update_agent_config(user_id, agent_id, agent_data):
-    from app import db
+    from agents.agent_cache import agent_cache
+    from .owner_index import owner_index
+    db = get_db()
     agent_ref = db.collection('custom_agents').document(agent_id)
-    agent = agent_ref.get()
-    if agent.exists and agent.to_dict().get('user_id') == user_id:
+    # The owner is fixed at creation, which is what lets the owner index be trusted
+    agent_data.pop('user_id', None)
+    if _check_owner(agent_ref, user_id):
         agent_data['updated_at'] = datetime.now(UTC).isoformat()
-        agent_ref.update(agent_data)
+        if 'agents' in agent_data:
+            agent_data['member_count'] = len(agent_data['agents'] or [])
+        try:
+            # update() only succeeds on an existing document, so a stale index entry
+            # for a deleted agent fails here instead of recreating it
+            agent_ref.update(agent_data)
+        except NotFound:
+            owner_index.invalidate(agent_id)
+            return jsonify({"error": "Agent not found or user_id mismatch"}), 404
+        agent_cache.invalidate(agent_id)
         return jsonify({"message": "Agent updated successfully"}), 200
     return jsonify({"error": "Agent not found or user_id mismatch"}), 404
 
 def delete_agent_config(user_id, agent_id):
-    from app import db
+    from agents.agent_cache import agent_cache
+    from .owner_index import owner_index
+    db = get_db()
     agent_ref = db.collection('custom_agents').document(agent_id)
-    agent = agent_ref.get()
-    if agent.exists and agent.to_dict().get('user_id') == user_id:
-        agent_ref.delete()
+    if _check_owner(agent_ref, user_id):
+        try:
+            agent_ref.delete(option=db.write_option(exists=True))
+        except NotFound:
+            owner_index.invalidate(agent_id, deleted=True)
+            return jsonify({"error": "Agent not found or user_id mismatch"}), 404
+        # Runs outlive the agent document, so a cached owner would keep them readable
+        owner_index.invalidate(agent_id, deleted=True)
+        agent_cache.invalidate(agent_id)
         return jsonify({"message": "Agent deleted successfully"}), 200
     return jsonify({"error": "Agent not found or user_id mismatch"}), 404
 
 def get_all_agents(user_id):
-    from app import db
+    db = get_db()
     agents = db.collection('custom_agents').where('user_id', '==', user_id).stream()
     agents_list = [agent.to_dict() for agent in agents]
     return jsonify(agents_list), 200
 
+# Fields returned when listing agents; full configs come from get_agent_config
+AGENT_LIST_FIELDS = ['agent_id', 'name', 'created_at', 'updated_at', 'member_count']
+AGENTS_PAGE_SIZE = 20
+AGENTS_MAX_PAGE_SIZE = 100
+
+def get_agents_etag(user_id, page_size=AGENTS_PAGE_SIZE, after=None):
+    """
+    ETag for a page of a user's agents, from the latest updated_at and the
+    agent count, so any create, update or delete changes it. Costs one
+    single-document query and one count aggregation.
+    """
+    db = get_db()
+    agents_ref = db.collection('custom_agents').where('user_id', '==', user_id)
+    latest = list(
+        agents_ref.order_by('updated_at', direction=firestore.Query.DESCENDING)
+        .select(['updated_at']).limit(1).stream()
+    )
+    latest_update = latest[0].to_dict().get('updated_at') if latest else None
+    count = agents_ref.count().get()[0][0].value
+    version = f"{latest_update}:{count}:{page_size}:{after}"
+    return hashlib.sha1(version.encode()).hexdigest()
+
+def list_agents(user_id, page_size=AGENTS_PAGE_SIZE, after=None):
+    """
+    One page of a user's agents, newest first, with the listing fields only.
+    Pass the returned next_after as after to get the following page.
+    """
+    db = get_db()
+    agents_ref = db.collection('custom_agents')
+    page_size = max(1, min(page_size, AGENTS_MAX_PAGE_SIZE))
+    # Served by the composite index on user_id + created_at (firestore.indexes.json)
+    query = agents_ref.where('user_id', '==', user_id).order_by('created_at', direction=firestore.Query.DESCENDING)
+    if after:
+        cursor = agents_ref.document(after).get(field_paths=['user_id', 'created_at'])
+        if not cursor.exists or cursor.to_dict().get('user_id') != user_id:
+            return jsonify({"error": "Invalid cursor"}), 400
+        query = query.start_after(cursor)
+
+    # One extra agent tells whether there is a next page
+    agents = list(query.select(AGENT_LIST_FIELDS).limit(page_size + 1).stream())
+    agents_list = [dict(agent.to_dict(), agent_id=agent.id) for agent in agents[:page_size]]
+    next_after = agents_list[-1]['agent_id'] if len(agents) > page_size else None
+    return jsonify({"agents": agents_list, "next_after": next_after}), 200
+
 def create_run(agent_id, run_data):
-    from app import db
+    db = get_db()
     run_ref = db.collection('custom_agents').document(agent_id).collection('runs').document()
     run_data['created_at'] = datetime.now(UTC).isoformat()
     run_data['run_id'] = run_ref.id
     run_ref.set(run_data)
     return run_ref.id
 
-def get_runs_for_agent(user_id, agent_id):
-    from app import db
+def queue_run(agent_id, run_data):
+    """
+    Same as create_run, but the write is queued and committed in the background.
+    """
+    from .write_behind import write_behind
+    db = get_db()
+    run_ref = db.collection('custom_agents').document(agent_id).collection('runs').document()
+    run_data['created_at'] = datetime.now(UTC).isoformat()
+    run_data['run_id'] = run_ref.id
+    write_behind.put(run_ref.path, run_data)
+    return run_ref.id
+
+# Fields returned when listing runs; the full output is only sent by the run detail
+RUN_LIST_FIELDS = ['run_id', 'user_id', 'user_input', 'created_at', 'metrics']
+RUNS_PAGE_SIZE = 20
+RUNS_MAX_PAGE_SIZE = 100
+
+def get_runs_for_agent(user_id, agent_id, page_size=RUNS_PAGE_SIZE, after=None):
+    """
+    One page of an agent's runs, newest first, without their outputs. Pass the
+    returned next_after as after to get the following page.
+    """
+    db = get_db()
     agent_ref = db.collection('custom_agents').document(agent_id)
-    agent = agent_ref.get()
-    
-    if not agent.exists or agent.to_dict().get('user_id') != user_id:
+    if not _check_owner(agent_ref, user_id):
         return jsonify({"error": "Agent not found or not authorized"}), 404
-        
-    runs = agent_ref.collection('runs').order_by('timestamp', direction=firestore.Query.DESCENDING).limit(100).stream()  # Add limit for safety
-    runs_list = [dict(run.to_dict(), id=run.id) for run in runs]  # Include document ID
-    return jsonify(runs_list), 200
+
+    runs_ref = agent_ref.collection('runs')
+    page_size = max(1, min(page_size, RUNS_MAX_PAGE_SIZE))
+    query = runs_ref.order_by('created_at', direction=firestore.Query.DESCENDING)
+    if after:
+        cursor = runs_ref.document(after).get(field_paths=['created_at'])
+        if not cursor.exists:
+            return jsonify({"error": "Invalid cursor"}), 400
+        query = query.start_after(cursor)
+
+    # One extra run tells whether there is a next page
+    runs = list(query.select(RUN_LIST_FIELDS).limit(page_size + 1).stream())
+    runs_list = [dict(run.to_dict(), id=run.id) for run in runs[:page_size]]  # Include document ID
+    next_after = runs_list[-1]['id'] if len(runs) > page_size else None
+    return jsonify({"runs": runs_list, "next_after": next_after}), 200
+
+def get_run_for_agent(user_id, agent_id, run_id):
+    db = get_db()
+    agent_ref = db.collection('custom_agents').document(agent_id)
+    if not _check_owner(agent_ref, user_id):
+        return jsonify({"error": "Agent not found or not authorized"}), 404
+
+    run = agent_ref.collection('runs').document(run_id).get()
+    if not run.exists:
+        return jsonify({"error": "Run not found"}), 404
+    return jsonify(dict(run.to_dict(), id=run.id)), 200
+
+# Runs read at most when aggregating an agent's stats
+RUN_STATS_LIMIT = 2000
+RUN_STATS_FIELDS = [
+    'created_at', 'metrics.latency', 'metrics.time_to_first_token',
+    'metrics.input_tokens', 'metrics.output_tokens', 'metrics.cost_usd',
+]
+
+# Runs read at most when totalling a user's usage across all their agents
+USER_RUN_STATS_LIMIT = 10000
+USER_RUN_STATS_FIELDS = ['created_at', 'metrics.input_tokens', 'metrics.output_tokens', 'metrics.cost_usd']
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def get_run_stats_for_agent(user_id, agent_id, days=30):
+    """
+    Latency percentiles, token totals and cost of an agent's runs over the last
+    days, and the user's totals across the runs of all their agents. Only the
+    metric fields of each run are read.
+    """
+    db = get_db()
+    agent_ref = db.collection('custom_agents').document(agent_id)
+    if not _check_owner(agent_ref, user_id):
+        return jsonify({"error": "Agent not found or not authorized"}), 404
+
+    since = (datetime.now(UTC) - timedelta(days=days)).isoformat()
+    runs = (
+        agent_ref.collection('runs')
+        .where('created_at', '>=', since)
+        .order_by('created_at', direction=firestore.Query.DESCENDING)
+        .limit(RUN_STATS_LIMIT)
+        .select(RUN_STATS_FIELDS)
+        .stream()
+    )
+
+    latencies = []
+    first_tokens = []
+    totals = {"runs": 0, "runs_with_metrics": 0, "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0}
+    for run in runs:
+        run_data = run.to_dict()
+        metrics = run_data.get('metrics') or {}
+        totals["runs"] += 1
+        if not metrics:
+            # Stored before metrics were recorded
+            continue
+        totals["runs_with_metrics"] += 1
+        if metrics.get('latency') is not None:
+            latencies.append(metrics['latency'])
+        if metrics.get('time_to_first_token') is not None:
+            first_tokens.append(metrics['time_to_first_token'])
+        for field in ("input_tokens", "output_tokens", "cost_usd"):
+            totals[field] += metrics.get(field) or 0
+
+    return jsonify({
+        "agent_id": agent_id,
+        "since": since,
+        **totals,
+        "latency": {"p50": _percentile(latencies, 0.5), "p95": _percentile(latencies, 0.95)},
+        "time_to_first_token": {"p50": _percentile(first_tokens, 0.5), "p95": _percentile(first_tokens, 0.95)},
+        "user": _get_user_run_totals(db, user_id, since),
+    }), 200
+
+def _get_user_run_totals(db, user_id, since):
+    """
+    Run count, tokens and cost of every run the user made since the given time,
+    across all their agents, from one collection-group query on runs.
+    """
+    # Served by the collection-group index on user_id + created_at (firestore.indexes.json)
+    runs = (
+        db.collection_group('runs')
+        .where('user_id', '==', user_id)
+        .where('created_at', '>=', since)
+        .limit(USER_RUN_STATS_LIMIT)
+        .select(USER_RUN_STATS_FIELDS)
+        .stream()
+    )
+    totals = {"user_id": user_id, "runs": 0, "agents": 0, "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0}
+    agent_ids = set()
+    for run in runs:
+        agent_ref = run.reference.parent.parent
+        # Other collections also have runs subcollections; only agent runs count here
+        if agent_ref is None or agent_ref.parent.id != 'custom_agents':
+            continue
+        metrics = run.to_dict().get('metrics') or {}
+        agent_ids.add(agent_ref.id)
+        totals["runs"] += 1
+        for field in ("input_tokens", "output_tokens", "cost_usd"):
+            totals[field] += metrics.get(field) or 0
+    totals["agents"] = len(agent_ids)
+    return totals
@@ -0,0 +1,214 @@
+import atexit
+import glob
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+from google.api_core import exceptions as google_exceptions
+
+from .db import get_db
+
+# Firestore accepts at most 500 writes per batch
+BATCH_SIZE = 500
+# How long the worker waits to fill a batch before committing what it has
+FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", 0.5))
+WRITE_ATTEMPTS = 5
+# Writes that still fail after all attempts are kept here and replayed later
+SPILL_PATH = os.getenv("WRITE_BEHIND_SPILL_PATH", "write_behind_spill.jsonl")
+# Seconds between replays of the spill file while the worker runs
+SPILL_REPLAY_INTERVAL = float(os.getenv("WRITE_BEHIND_SPILL_REPLAY_INTERVAL", 300))
+# Errors worth retrying; anything else Firestore rejects (an oversized or invalid
+# document, a denied path) fails the same way every time
+RETRYABLE_ERRORS = (
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.TooManyRequests,
+    google_exceptions.Aborted,
+    google_exceptions.Unknown,
+)
+
+
+def _is_retryable(error):
+    # Errors from outside the API (a dropped connection, an expired token) are transient too
+    return isinstance(error, RETRYABLE_ERRORS) or not isinstance(error, google_exceptions.GoogleAPICallError)
+
+
+class WriteBehindQueue:
+    """
+    Queues Firestore document writes and commits them from a background thread
+    in WriteBatches, so requests do not wait on the round trip. Document ids are
+    generated client side, so callers can return them before the write lands.
+
+    Failed batches are retried with backoff and then appended to a local spill
+    file, which the worker replays at start and every SPILL_REPLAY_INTERVAL
+    seconds, deleting it only once its writes are committed. A batch Firestore
+    rejects is retried write by write, and writes that can never succeed are
+    logged and dropped rather than spilled. Writes still queued at interpreter
+    exit are flushed, or spilled if that fails.
+    """
+
+    def __init__(self, spill_path: str = SPILL_PATH):
+        self.spill_path = spill_path
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.spill_lock = threading.Lock()
+        self.worker = None
+        self.pid = None
+
+    def _ensure_worker(self):
+        # Threads do not survive a fork; each process starts its own worker
+        with self.lock:
+            if self.worker is not None and self.pid == os.getpid() and self.worker.is_alive():
+                return
+            if self.pid is not None and self.pid != os.getpid():
+                # Forked: whatever the parent had queued is the parent's to write
+                self.queue = queue.Queue()
+            self.pid = os.getpid()
+            replay_paths = self._claim_spills()
+            self.worker = threading.Thread(target=self._run, args=(replay_paths,), name="firestore-write-behind", daemon=True)
+            self.worker.start()
+
+    def put(self, path: str, data: dict, merge: bool = False):
+        """
+        Queues a set() of the document at path, e.g. "custom_agents/<id>/runs/<run_id>".
+        """
+        self._ensure_worker()
+        self.queue.put({"path": path, "data": data, "merge": merge})
+
+    def _take_batch(self, timeout=None):
+        try:
+            writes = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + FLUSH_INTERVAL
+        while len(writes) < BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                writes.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return writes
+
+    def _run(self, replay_paths=()):
+        for replay_path in replay_paths:
+            self._replay(replay_path)
+        next_replay = time.monotonic() + SPILL_REPLAY_INTERVAL
+        while True:
+            writes = self._take_batch(timeout=max(0, next_replay - time.monotonic()))
+            if writes:
+                self._commit(writes)
+            if time.monotonic() >= next_replay:
+                # Spilled writes (a deferred agent create, say) should not wait for a restart
+                for replay_path in self._claim_spills():
+                    self._replay(replay_path)
+                next_replay = time.monotonic() + SPILL_REPLAY_INTERVAL
+
+    def _commit(self, writes):
+        """
+        Commits writes in one batch, retrying transient errors. If the batch is
+        rejected outright, one bad write must not hold back the rest, so they
+        are committed one at a time instead.
+        """
+        db = get_db()
+        for attempt in range(WRITE_ATTEMPTS):
+            try:
+                batch = db.batch()
+                for write in writes:
+                    batch.set(db.document(write["path"]), write["data"], merge=write["merge"])
+                batch.commit()
+                return True
+            except Exception as e:
+                print(f"Error committing {len(writes)} queued Firestore writes (attempt {attempt + 1}): {e}")
+                if not _is_retryable(e):
+                    if len(writes) == 1:
+                        print(f"Dropping Firestore write to {writes[0]['path']}, which cannot succeed: {e}")
+                        return False
+                    return all([self._commit([write]) for write in writes])
+                if attempt < WRITE_ATTEMPTS - 1:
+                    time.sleep(min(2 ** attempt, 30))
+        self._spill(writes)
+        return False
+
+    def _spill(self, writes):
+        try:
+            with self.spill_lock, open(self.spill_path, "a") as spill_file:
+                for write in writes:
+                    spill_file.write(json.dumps(write, default=str) + "\n")
+            print(f"Spilled {len(writes)} Firestore writes to {self.spill_path}")
+        except Exception as e:
+            print(f"Error spilling Firestore writes, {len(writes)} writes lost: {e}")
+
+    def _claim_spills(self):
+        """
+        Claims the spill file, and any replay file left by a process that died
+        mid-replay, by renaming them to this process's replay files, so two
+        processes never replay the same writes.
+        """
+        claimed = []
+        candidates = [self.spill_path] + sorted(glob.glob(f"{glob.escape(self.spill_path)}.*.replay"))
+        for path in candidates:
+            # Replay files are named <spill_path>.<pid>[.<id>].replay after the process replaying them
+            owner = path[len(self.spill_path) + 1:].split(".", 1)[0]
+            if path != self.spill_path and owner != str(os.getpid()) and _pid_alive(owner):
+                continue
+            replay_path = f"{self.spill_path}.{os.getpid()}.{uuid.uuid4().hex}.replay"
+            try:
+                os.rename(path, replay_path)
+            except OSError:
+                continue
+            claimed.append(replay_path)
+        return claimed
+
+    def _replay(self, replay_path):
+        """
+        Commits the writes of a claimed spill file and only then deletes it, so a
+        crash mid-replay leaves the file to be claimed again. Writes that fail
+        again are spilled anew, and unreadable lines are skipped.
+        """
+        writes = []
+        with open(replay_path) as replay_file:
+            for line_number, line in enumerate(replay_file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    write = json.loads(line)
+                    writes.append({"path": write["path"], "data": write["data"], "merge": write.get("merge", False)})
+                except (ValueError, KeyError, TypeError) as e:
+                    print(f"Skipping unreadable spilled write on line {line_number} of {replay_path}: {e}")
+        for start in range(0, len(writes), BATCH_SIZE):
+            self._commit(writes[start:start + BATCH_SIZE])
+        os.remove(replay_path)
+        print(f"Replayed {len(writes)} spilled Firestore writes from {replay_path}")
+
+    def flush(self):
+        """
+        Commits everything still queued in the calling thread. Used at exit.
+        """
+        writes = []
+        while True:
+            try:
+                writes.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        for start in range(0, len(writes), BATCH_SIZE):
+            self._commit(writes[start:start + BATCH_SIZE])
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+write_behind = WriteBehindQueue()
+atexit.register(write_behind.flush)
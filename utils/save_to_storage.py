@@ -3,9 +3,14 @@ from config import storage_client
 import csv, os
 from io import StringIO
 
+import contextlib
+import gzip
 import os
 import re
 
+# Bytes sent per request of a resumable upload (a multiple of 256 KiB)
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
 def swap_gcs_to_cdn_url(url, old_base_url=os.environ.get("GOOGLE_STORAGE_BASE_URL")):
     """
     Swaps Google Cloud Storage URLs with the CDN URL defined in the CDN_BASE_URL environment variable.
@@ -92,3 +97,32 @@ def upload_csv_to_bucket(csv_string:str, destination_blob_name: str, timeout: in
     except Exception as e:
         print(f"Error uploading CSV to bucket: {str(e)}")
         raise
+
+
+@contextlib.contextmanager
+def open_blob_writer(destination_blob_name: str, content_type: str = 'text/csv', gzip_compress: bool = False):
+    """
+    Opens a binary stream into a resumable upload to a Cloud Storage blob. Data
+    is sent in chunks as it is written, so nothing is held in memory in full.
+    With gzip_compress the stream is gzipped and the blob stored with
+    Content-Encoding: gzip, which Cloud Storage decompresses for clients that
+    do not accept gzip.
+
+    Yields:
+        tuple: (stream, blob). The upload completes when the block exits.
+    """
+    bucket = storage_client.bucket(os.environ.get('BUCKET_NAME'))
+    blob = bucket.blob(destination_blob_name)
+    if gzip_compress:
+        blob.content_encoding = 'gzip'
+
+    # ignore_flush: BlobWriter.flush() raises, since a resumable upload can only
+    # send whole chunks, and text or gzip wrappers flush their target
+    with blob.open('wb', chunk_size=UPLOAD_CHUNK_SIZE, content_type=content_type, ignore_flush=True) as upload:
+        if not gzip_compress:
+            yield upload, blob
+            return
+        # Closing the GzipFile writes the gzip trailer but leaves the upload open
+        with gzip.GzipFile(fileobj=upload, mode='wb') as compressed:
+            yield compressed, blob
+